@@ -1,12 +1,16 @@
 # agent.py
 from langchain_aws import ChatBedrock
-from langchain_core.messages import HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
 from langgraph.prebuilt import create_react_agent
 from langgraph.checkpoint.memory import MemorySaver
+from collections import OrderedDict
 import os
 import logging
 import json
 import re
+import threading
+import time
 from custom_tools import create_image_tool, code_interpreter
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain.utilities.tavily_search import TavilySearchAPIWrapper
@@ -24,10 +28,182 @@ logger = logging.getLogger(__name__)
 logger.info(f"DEBUG TAVILY_API_KEY: {st.secrets['default']['TAVILY_API_KEY']}")
 
 
-def initialize_agent(model_id):
-    """Initialize and return a ReAct agent with Bedrock and Tavily search capabilities."""
-    memory = MemorySaver()
-    
+# Conversation threads kept by the agent checkpointer (one per chat session); the least
+# recently used are evicted above AGENT_MAX_THREADS and idle ones after AGENT_THREAD_TTL seconds
+AGENT_MAX_THREADS = int(os.getenv('AGENT_MAX_THREADS', '500'))
+AGENT_THREAD_TTL = int(os.getenv('AGENT_THREAD_TTL', '3600'))
+# Messages kept per thread, and the token budget of the history sent to the model each turn
+AGENT_MAX_THREAD_MESSAGES = int(os.getenv('AGENT_MAX_THREAD_MESSAGES', '40'))
+AGENT_HISTORY_TOKENS = int(os.getenv('AGENT_HISTORY_TOKENS', '16000'))
+# Run config key carrying the current turn's prompt with retrieved context. LangGraph
+# copies string "configurable" values into checkpoint metadata unless the key starts with "__".
+AUGMENTED_PROMPT_KEY = "__augmented_prompt"
+
+
+class BoundedMemorySaver(MemorySaver):
+    """
+    MemorySaver that keeps memory bounded for a long-running, multi-user server.
+
+    Only the newest checkpoints_per_thread checkpoints of each thread are kept (each
+    one holds the full conversation), threads idle for longer than ttl seconds are
+    dropped, and the least recently used threads are evicted above max_threads.
+    """
+
+    def __init__(self, max_threads=AGENT_MAX_THREADS, ttl=AGENT_THREAD_TTL, checkpoints_per_thread=2):
+        super().__init__()
+        self.max_threads = max_threads
+        self.ttl = ttl
+        self.checkpoints_per_thread = checkpoints_per_thread
+        self._last_used = OrderedDict()  # thread id -> last access time, oldest first
+        self._lock = threading.RLock()
+
+    def _touch(self, thread_id):
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._last_used:
+            thread_id, last_used = next(iter(self._last_used.items()))
+            if last_used >= cutoff and len(self._last_used) <= self.max_threads:
+                break
+            self.delete_thread(thread_id)
+
+    def _prune(self, thread_id, checkpoint_ns):
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        # Checkpoint ids are time-ordered (uuid6)
+        for checkpoint_id in sorted(checkpoints)[:-self.checkpoints_per_thread]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+    def delete_thread(self, thread_id):
+        """Forget every checkpoint and pending write of thread_id."""
+        with self._lock:
+            self._last_used.pop(thread_id, None)
+            self.storage.pop(thread_id, None)
+            for key in [key for key in self.writes if key[0] == thread_id]:
+                del self.writes[key]
+
+    def get_tuple(self, config):
+        with self._lock:
+            self._evict()
+            return super().get_tuple(config)
+
+    def list(self, config, **kwargs):
+        with self._lock:
+            return iter(list(super().list(config, **kwargs)))
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            saved = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            self._prune(thread_id, config["configurable"]["checkpoint_ns"])
+            self._touch(thread_id)
+            self._evict()
+            return saved
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            super().put_writes(config, writes, task_id, task_path)
+            self._touch(config["configurable"]["thread_id"])
+
+
+# Shared by every cached agent graph; conversations are separated by thread id
+agent_memory = BoundedMemorySaver()
+
+
+def _agent_prompt(state, config):
+    """
+    Prompt for the agent: the most recent messages that fit in AGENT_HISTORY_TOKENS.
+
+    The thread stores each user message without its retrieved context. The current
+    turn's context is passed in the run config (AUGMENTED_PROMPT_KEY) and replaces the
+    latest user message for this model call only, so earlier turns stay small and
+    the history budget is spent on the conversation rather than on old context.
+    """
+    messages = state["messages"]
+    trimmed = trim_messages(
+        messages,
+        max_tokens=AGENT_HISTORY_TOKENS,
+        token_counter=count_tokens_approximately,
+        strategy="last",
+        start_on="human",
+        include_system=True,
+    )
+    if not trimmed:
+        # The latest turn alone exceeds the budget; send it anyway
+        last_human = max(i for i, message in enumerate(messages) if isinstance(message, HumanMessage))
+        trimmed = messages[last_human:]
+
+    augmented_prompt = config.get("configurable", {}).get(AUGMENTED_PROMPT_KEY)
+    if augmented_prompt:
+        last_human = max(i for i, message in enumerate(trimmed) if isinstance(message, HumanMessage))
+        trimmed = list(trimmed)
+        trimmed[last_human] = trimmed[last_human].model_copy(update={"content": augmented_prompt})
+    return trimmed
+
+
+# Tools given to the agent by default, by name (see _build_tool)
+DEFAULT_AGENT_TOOLS = ("tavily_search", "create_image", "code_interpreter", "pubmed")
+
+# Process-wide registries: model id -> chat model, tool name -> tool,
+# (model id, tool names) -> compiled agent graph
+_chat_models = {}
+_tools = {}
+_agents = {}
+_registry_lock = threading.Lock()
+
+
+def _build_tool(name):
+    if name == "tavily_search":
+        # Initialize Tavily search without passing api_key directly
+        logging.info("Initializing Tavily search...")
+        return TavilySearchResults(api_wrapper=TavilySearchAPIWrapper())
+    if name == "pubmed":
+        return PubmedQueryRun()
+    if name == "create_image":
+        return create_image_tool
+    if name == "code_interpreter":
+        return code_interpreter
+    raise ValueError(f"Unknown agent tool: {name}")
+
+
+def get_chat_model(model_id):
+    """Return the shared ChatBedrock client for model_id, creating it on first use."""
+    with _registry_lock:
+        if model_id not in _chat_models:
+            logging.info(f"Initializing Bedrock model {model_id}...")
+            _chat_models[model_id] = ChatBedrock(
+                model=model_id,
+                beta_use_converse_api=True,
+                streaming=True,
+                region_name=st.secrets["default"]["REGION"]
+            )
+        return _chat_models[model_id]
+
+
+def get_tool(name):
+    """Return the shared instance of the named agent tool, creating it on first use."""
+    with _registry_lock:
+        if name not in _tools:
+            _tools[name] = _build_tool(name)
+        return _tools[name]
+
+
+def initialize_agent(model_id, tools=DEFAULT_AGENT_TOOLS):
+    """
+    Return a ReAct agent with Bedrock and the given tools (Tavily search by default).
+
+    Compiled agents are cached per (model id, tool names) for the whole process, so
+    Streamlit reruns and new sessions reuse the model client and the compiled graph.
+    Failed initializations are not cached.
+    """
+    key = (model_id, tuple(tools))
+    with _registry_lock:
+        agent_executor = _agents.get(key)
+    if agent_executor is not None:
+        return agent_executor
+
     # Retrieve the TAVILY_API_KEY from secrets
     api_key = st.secrets['default'].get('TAVILY_API_KEY')
     if not api_key:
@@ -43,30 +219,20 @@ def initialize_agent(model_id):
     os.environ["TAVILY_API_KEY"] = api_key
     
     try:
-        # Initialize Bedrock model
-        logging.info("Initializing Bedrock model...")
-        model = ChatBedrock(
-            model=model_id,
-            beta_use_converse_api=True,
-            streaming=True,
-            region_name=st.secrets["default"]["REGION"]
-        )
-        
-        # Initialize Tavily search without passing api_key directly
-        logging.info("Initializing Tavily search...")
-        tavily_search = TavilySearchAPIWrapper()
-        search = TavilySearchResults(api_wrapper=tavily_search)
+        model = get_chat_model(model_id)
+        agent_tools = [get_tool(name) for name in tools]
         
-        # Initialize PubMed search
-        pubmed_search = PubmedQueryRun()
-        
-        # Create agent executor with tools
+        # Create agent executor with tools. The graph is shared by every session;
+        # each session keeps its conversation in its own checkpointer thread.
         logging.info("Creating agent executor...")
         agent_executor = create_react_agent(
             model,
-            tools=[search, create_image_tool, code_interpreter, pubmed_search],
-            checkpointer=memory
+            tools=agent_tools,
+            prompt=_agent_prompt,
+            checkpointer=agent_memory,
         )
+        with _registry_lock:
+            agent_executor = _agents.setdefault(key, agent_executor)
         
         logging.info("Agent executor initialized successfully.")
         return agent_executor
@@ -77,16 +243,44 @@ def initialize_agent(model_id):
         return None
 
 
-def query_agent(agent_executor, messages):
+def _start_turn(agent_executor, config, prompt, history):
+    """Return the input messages for a turn, capping the stored thread at AGENT_MAX_THREAD_MESSAGES."""
+    stored = agent_executor.get_state(config).values.get("messages", [])
+    if not stored:
+        # New thread (new session, or evicted): seed it with the visible chat history
+        seeded = [
+            HumanMessage(content=message["content"]) if message["role"] in ("user", "human")
+            else AIMessage(content=message["content"])
+            for message in (history or [])[-AGENT_MAX_THREAD_MESSAGES:]
+        ]
+        return seeded + [HumanMessage(content=prompt)]
+
+    if len(stored) >= AGENT_MAX_THREAD_MESSAGES:
+        # Drop the oldest messages, keeping the thread starting on a human message
+        # so tool calls stay paired with their results
+        cut = len(stored) - AGENT_MAX_THREAD_MESSAGES + 1
+        while cut < len(stored) and not isinstance(stored[cut], HumanMessage):
+            cut += 1
+        agent_executor.update_state(config, {"messages": [RemoveMessage(id=message.id) for message in stored[:cut]]})
+    return [HumanMessage(content=prompt)]
+
+
+def query_agent(agent_executor, prompt, thread_id, history=None, augmented_prompt=None):
     """
-    Query the agent with a list of messages and return the streamed response.
+    Send one new user message to the agent in conversation thread_id and return the streamed response.
+
+    The agent remembers earlier turns of the thread itself, so only the new prompt is
+    sent; history (the chat's earlier {"role", "content"} messages) is only used to
+    seed a thread the checkpointer does not know yet. augmented_prompt (the prompt
+    with retrieved context) is shown to the model for this turn only; the thread
+    stores the plain prompt, and neither it nor the checkpoint metadata keeps the context.
     Yields chunks of three possible types:
       - {"type": "response", "content": text}
       - {"type": "tool_log", "content": log_text}
       - {"type": "error", "content": error_message}
     """
-    logger.info(f"Sending messages: {messages}")
-    config = {"configurable": {"thread_id": "abc123"}}
+    logger.info(f"Sending prompt to thread {thread_id} ({len(prompt)} chars)")
+    config = {"configurable": {"thread_id": thread_id, AUGMENTED_PROMPT_KEY: augmented_prompt}}
 
     # Define a combined regex pattern to extract and remove both tool use logs and text logs
     log_pattern = re.compile(
@@ -96,6 +290,7 @@ def query_agent(agent_executor, messages):
     )
 
     try:
+        messages = _start_turn(agent_executor, config, prompt, history)
         for chunk in agent_executor.stream({"messages": messages}, config):
             # Check if we have messages in the chunk
             if "agent" in chunk and "messages" in chunk["agent"]:
@@ -124,4 +319,25 @@ def query_agent(agent_executor, messages):
 
     except Exception as e:
         logger.error(f"Error during agent query: {e}", exc_info=True)
-        yield {"type": "error", "content": f"An error occurred: {e}"}
\ No newline at end of file
+        yield {"type": "error", "content": f"An error occurred: {e}"}
+
+
+if __name__ == "__main__":
+    # Example usage with a stand-in model: the retrieved context is shown to the model
+    # but kept out of the stored thread and its checkpoint metadata
+    from langchain_core.language_models.fake_chat_models import FakeMessagesListChatModel
+
+    example_agent = create_react_agent(
+        FakeMessagesListChatModel(responses=[AIMessage(content="DeepQuery answers questions about your files.")]),
+        tools=[],
+        prompt=_agent_prompt,
+        checkpointer=agent_memory,
+    )
+    context = "Retrieved context: DeepQuery is a document assistant."
+    for chunk in query_agent(example_agent, "What is DeepQuery?", "example", augmented_prompt=f"{context}\n\nWhat is DeepQuery?"):
+        print(chunk)
+
+    checkpoint = agent_memory.get_tuple({"configurable": {"thread_id": "example"}})
+    assert context not in json.dumps(checkpoint.metadata, default=str), "context leaked into checkpoint metadata"
+    assert all(context not in str(message.content) for message in checkpoint.checkpoint["channel_values"]["messages"])
+    print(f"Checkpoint metadata keys: {sorted(checkpoint.metadata)}")
@@ -1,21 +1,32 @@
 import streamlit as st
 import os
 import logging
+import uuid
 from agent import initialize_agent, query_agent
-from local_vector_store import create_vector_store, add_documents_to_store, search_documents
+from local_vector_store import (
+    create_vector_store,
+    add_documents_to_store,
+    IndexCache,
+    index_cache_key,
+    index_path,
+    save_vector_store,
+    load_vector_store,
+    prune_index_dir,
+)
 from langchain_community.document_loaders import PDFPlumberLoader, Docx2txtLoader
-from standard_chat import query_chat
+from standard_chat import stream_chat
 import tempfile
-from auth import login_page, logout, get_user_info, register_page, check_token  # Import the authentication functions
+from auth import login_page, logout, get_user_info, invalidate_user_info, register_page, check_token  # Import the authentication functions
 from dynamodb import (
-    create_dynamodb_table,
-    get_chat_history,
+    ensure_tables,
+    get_chat_history_page,
     add_user_message,
     add_ai_message,
     clear_chat_history,
 )  # DynamoDB functions
-from packs import get_current_packs, query_pinecone_pack  # Import the get_current_packs function
-import json
+from packs import get_current_packs  # Import the get_current_packs function
+from retrieval import retrieve, assemble_context, token_budget_for
+from semantic_cache import SEMANTIC_CACHE_REUSE_ANSWERS
 import pandas as pd
 # Remove TavilySearchResults and its wrapper imports since we are using the official client
 #from langchain_community.tools.tavily_search import TavilySearchResults
@@ -41,6 +52,12 @@ os.environ["AWS_ACCESS_KEY_ID"] = st.secrets["default"]["ACCESS_KEY"]
 os.environ["AWS_SECRET_ACCESS_KEY"] = st.secrets["default"]["SECRET_KEY"]
 os.environ["AWS_DEFAULT_REGION"] = st.secrets["default"]["REGION"]
 
+# Share built document indexes across sessions (same file bytes -> same index)
+SHARE_INDEX_CACHE = os.getenv("SHARE_INDEX_CACHE", "false").lower() == "true"
+
+# Chat history is loaded and rendered this many messages at a time
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "20"))
+
 # === Immediately inject localStorage script for persistent login ===
 def inject_localStorage_script():
     st.markdown("""
@@ -609,18 +626,30 @@ if "clear_chat_trigger" not in st.session_state:
     st.session_state.clear_chat_trigger = False
 if "should_save_auth" not in st.session_state:
     st.session_state.should_save_auth = False
+if "history_cursor" not in st.session_state:
+    st.session_state.history_cursor = None  # where older stored messages start, None if all loaded
+if "cache_session_id" not in st.session_state:
+    st.session_state.cache_session_id = uuid.uuid4().hex  # semantic cache owner when logged out
+if "agent_thread_id" not in st.session_state:
+    st.session_state.agent_thread_id = uuid.uuid4().hex  # this session's agent conversation
+if "history_window" not in st.session_state:
+    st.session_state.history_window = CHAT_HISTORY_PAGE_SIZE  # number of trailing messages rendered
 
 def handle_clear_chat_history():
     if st.session_state.logged_in and st.session_state.access_token:
         user_id = str(st.session_state.user_info["id"])
         if clear_chat_history(user_id):
             st.session_state.messages = []
+            st.session_state.history_cursor = None
+            st.session_state.history_window = CHAT_HISTORY_PAGE_SIZE
+            st.session_state.agent_thread_id = uuid.uuid4().hex
             st.session_state.clear_chat_trigger = True
         else:
             st.error("Failed to clear chat history")
     else:
         if "messages" in st.session_state:
             st.session_state.messages = []
+            st.session_state.agent_thread_id = uuid.uuid4().hex
             st.session_state.clear_chat_trigger = True
 
 def toggle_login_page():
@@ -629,17 +658,91 @@ def toggle_login_page():
 def load_user_chat_history():
     if st.session_state.logged_in and "user_info" in st.session_state:
         user_id = str(st.session_state.user_info["id"])
-        chat_history = get_chat_history(user_id)
+        # Only the latest page is loaded; older pages are fetched by load_older_messages
+        chat_history, cursor = get_chat_history_page(user_id, CHAT_HISTORY_PAGE_SIZE)
         logging.info(f"Retrieved chat history for user {user_id}: {len(chat_history)} messages")
         st.session_state.messages = chat_history
+        st.session_state.history_cursor = cursor
+        st.session_state.history_window = CHAT_HISTORY_PAGE_SIZE
         return chat_history
     return []
 
+def semantic_cache_scope(username, selected_packs, index_key):
+    """Scope for reusing retrieval results: the user (or this session when logged out) and the sources."""
+    owner = username or f"session:{st.session_state.cache_session_id}"
+    return (owner, tuple(selected_packs), index_key)
+
+def load_older_messages():
+    """Render one more page of older messages, fetching it from DynamoDB if not loaded yet."""
+    st.session_state.history_window += CHAT_HISTORY_PAGE_SIZE
+    missing = st.session_state.history_window - len(st.session_state.messages)
+    if missing > 0 and st.session_state.history_cursor is not None and "user_info" in st.session_state:
+        user_id = str(st.session_state.user_info["id"])
+        older, cursor = get_chat_history_page(user_id, missing, before=st.session_state.history_cursor)
+        st.session_state.messages = older + st.session_state.messages
+        st.session_state.history_cursor = cursor
+
+@st.cache_resource
+def get_shared_index_cache():
+    """Process-wide index cache shared by all sessions."""
+    return IndexCache()
+
+def get_index_cache():
+    """Return the index cache for this session (or the shared one if enabled)."""
+    if SHARE_INDEX_CACHE:
+        return get_shared_index_cache()
+    if "index_cache" not in st.session_state:
+        st.session_state.index_cache = IndexCache()
+    return st.session_state.index_cache
+
+def find_cached_index(index_key, embedding):
+    """Return the index for index_key from the memory cache or disk, or None if it was never built."""
+    index_cache = get_index_cache()
+    cached_store = index_cache.get(index_key)
+    if cached_store is not None:
+        logging.info(f"Index cache hit for {index_key[:12]}; skipping extraction and embedding.")
+        return cached_store
+    saved_store = load_vector_store(index_path(index_key), embedding)
+    if saved_store is not None:
+        index_cache.put(index_key, saved_store)
+    return saved_store
+
+def get_or_build_index(vector_store, index_key, file_contents):
+    """
+    Return the cached index for index_key, embedding file_contents into vector_store on a miss.
+    With index_key None (e.g. the file could not be parsed) the index is built but not cached or saved.
+    """
+    if index_key is None:
+        add_documents_to_store(vector_store, file_contents)
+        return vector_store
+    cached_store = find_cached_index(index_key, vector_store.embedding)
+    if cached_store is not None:
+        return cached_store
+    index_cache = get_index_cache()
+    progress_bar = st.sidebar.progress(0.0, text="Embedding document...")
+
+    def report_progress(done, total):
+        progress_bar.progress(done / total, text=f"Embedded {done}/{total} chunks")
+
+    add_documents_to_store(vector_store, file_contents, progress_callback=report_progress)
+    progress_bar.empty()
+    try:
+        save_vector_store(vector_store, index_path(index_key))
+        prune_index_dir(keep={index_path(index_key)})
+    except OSError as e:
+        logging.error(f"Failed to save index {index_key[:12]}: {e}")
+    index_cache.put(index_key, vector_store)
+    return vector_store
+
 def custom_logout():
     logging.info("User logged out.")
+    invalidate_user_info(st.session_state.get("access_token"))
     st.session_state.logged_in = False
     st.session_state.access_token = None
     st.session_state.messages = []
+    st.session_state.history_cursor = None
+    st.session_state.history_window = CHAT_HISTORY_PAGE_SIZE
+    st.session_state.agent_thread_id = uuid.uuid4().hex
     if "user_info" in st.session_state:
         del st.session_state.user_info
     st.session_state.logout_trigger = not st.session_state.logout_trigger
@@ -684,12 +787,16 @@ def main_page():
         st.sidebar.button("Login", on_click=toggle_login_page)
 
     if st.session_state.logged_in:
-        create_dynamodb_table()
+        ensure_tables()  # no DynamoDB calls once the tables were seen in this process
     
     # Create a container for the chat messages with proper styling
     with st.container():
+        # Only the latest history_window messages are rendered; older ones on demand
+        messages = st.session_state.messages
+        if len(messages) > st.session_state.history_window or st.session_state.history_cursor is not None:
+            st.button("Load older messages", on_click=load_older_messages)
         # Display messages with custom styling
-        for message in st.session_state.messages:
+        for message in messages[-st.session_state.history_window:]:
             role = message["role"]
             content = message["content"]
             
@@ -715,6 +822,8 @@ def main_page():
         selected_model = st.sidebar.selectbox("Chat Model", model_options)
         st.sidebar.write(f"You selected: {selected_model}")
         vector_store = create_vector_store()
+        index_key = None
+        upload_failed = False
         uploaded_file = st.sidebar.file_uploader(
             "Upload a file for context",
             type=["txt", "pdf", "docx", "csv", "json", "xlsx"],
@@ -722,7 +831,12 @@ def main_page():
         if uploaded_file is not None:
             file_id = uploaded_file.name
             metadata = {"type": uploaded_file.type}
-            if uploaded_file.type == "application/pdf":
+            index_key = index_cache_key(uploaded_file.getvalue())
+            # Look the index up before parsing; CSVs are still read for the preview and charts
+            cached_index = find_cached_index(index_key, vector_store.embedding)
+            if cached_index is not None and uploaded_file.type != "text/csv":
+                pass  # already indexed; skip re-parsing the document on every rerun
+            elif uploaded_file.type == "application/pdf":
                 try:
                     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
                         temp_file.write(uploaded_file.read())
@@ -738,6 +852,7 @@ def main_page():
                     st.sidebar.error(f"Error extracting content from PDF file: {str(e)}")
                     logging.error(f"PDF processing error: {str(e)}")
                     file_content = f"Error processing PDF file {file_id}: {str(e)}"
+                    index_key = None  # never cache or save an index of a failed extraction
             elif uploaded_file.type == "text/csv":
                 df = pd.read_csv(uploaded_file)
                 preview = df.head(10).to_string()
@@ -812,6 +927,7 @@ def main_page():
                 except Exception as e:
                     st.sidebar.error(f"Error extracting content from DOCX file: {str(e)}")
                     file_content = f"Error processing DOCX file {file_id}: {str(e)}"
+                    index_key = None  # never cache or save an index of a failed extraction
             else:
                 # More robust file content handling for other file types
                 try:
@@ -836,32 +952,35 @@ def main_page():
                             except Exception as e:
                                 file_size = len(uploaded_file.getvalue())
                                 file_content = f"Binary file: {file_id}, Size: {file_size} bytes. Could not extract content."
+                                index_key = None  # never cache or save an index of a failed extraction
                                 st.sidebar.warning(f"Could not extract text from {file_id}. Please convert to PDF or DOCX format for better results.")
                         else:
                             # For other binary files, create a summary instead of failing
                             file_size = len(uploaded_file.getvalue())
                             file_content = f"Binary file: {file_id}, Size: {file_size} bytes. Could not extract content."
+                            index_key = None  # never cache or save an index of a failed extraction
                             st.sidebar.warning(f"Note: {file_id} appears to be a binary file or uses a non-UTF-8 encoding. Limited context extraction will be available.")
                     except Exception as e:
                         st.sidebar.error(f"Error processing file: {str(e)}")
                         file_content = f"Error processing file {file_id}: {str(e)}"
-            add_documents_to_store(vector_store, [(file_id, file_content, metadata)])
+                        index_key = None  # never cache or save an index of a failed extraction
+            if cached_index is not None:
+                vector_store = cached_index
+            else:
+                vector_store = get_or_build_index(vector_store, index_key, [(file_id, file_content, metadata)])
+            upload_failed = index_key is None
             st.sidebar.success("File uploaded and embedded successfully!")
         if st.session_state.logged_in:
             packs = get_current_packs()
-            pack_options = ["No Pack"] + [pack["Pack Name"] for pack in packs]
-            selected_pack = st.sidebar.selectbox("Connect to a Pack", pack_options)
-            if selected_pack != "No Pack":
-                selected_pack_info = next(
-                    pack for pack in packs if pack["Pack Name"] == selected_pack
-                )
-                st.session_state.selected_pack_id = selected_pack_info["Pack ID"]
-            else:
-                st.session_state.selected_pack_id = None
-            st.sidebar.write(f"You selected: {selected_pack}")
+            pack_options = [pack["Pack Name"] for pack in packs]
+            selected_packs = st.sidebar.multiselect("Connect to Packs", pack_options)
+            st.session_state.selected_pack_ids = [
+                pack["Pack ID"] for pack in packs if pack["Pack Name"] in selected_packs
+            ]
+            st.sidebar.write(f"You selected: {', '.join(selected_packs) or 'No Pack'}")
         else:
             st.sidebar.info("Login to access your Packs")
-            selected_pack = "No Pack"
+            selected_packs = []
     elif media_gen_or_text_gen == "Standard Chat":
         st.sidebar.write("Standard Chat options will be displayed here.")
         model = st.sidebar.selectbox("Select a model", ["meta/meta-llama-3-8b-instruct", "anthropic/claude-3.5-haiku", "deepseek-ai/deepseek-r1"])
@@ -869,6 +988,8 @@ def main_page():
         
         # Add vector store and file upload capabilities
         vector_store = create_vector_store()
+        index_key = None
+        upload_failed = False
         uploaded_file = st.sidebar.file_uploader(
             "Upload a file for context",
             type=["txt", "pdf", "docx", "csv", "json", "xlsx"],
@@ -878,7 +999,12 @@ def main_page():
         if uploaded_file is not None:
             file_id = uploaded_file.name
             metadata = {"type": uploaded_file.type}
-            if uploaded_file.type == "application/pdf":
+            index_key = index_cache_key(uploaded_file.getvalue())
+            # Look the index up before parsing; CSVs are still read for the preview and charts
+            cached_index = find_cached_index(index_key, vector_store.embedding)
+            if cached_index is not None and uploaded_file.type != "text/csv":
+                pass  # already indexed; skip re-parsing the document on every rerun
+            elif uploaded_file.type == "application/pdf":
                 try:
                     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
                         temp_file.write(uploaded_file.read())
@@ -894,6 +1020,7 @@ def main_page():
                     st.sidebar.error(f"Error extracting content from PDF file: {str(e)}")
                     logging.error(f"PDF processing error: {str(e)}")
                     file_content = f"Error processing PDF file {file_id}: {str(e)}"
+                    index_key = None  # never cache or save an index of a failed extraction
             elif uploaded_file.type == "text/csv":
                 df = pd.read_csv(uploaded_file)
                 preview = df.head(10).to_string()
@@ -968,6 +1095,7 @@ def main_page():
                 except Exception as e:
                     st.sidebar.error(f"Error extracting content from DOCX file: {str(e)}")
                     file_content = f"Error processing DOCX file {file_id}: {str(e)}"
+                    index_key = None  # never cache or save an index of a failed extraction
             else:
                 # More robust file content handling for other file types
                 try:
@@ -992,32 +1120,35 @@ def main_page():
                             except Exception as e:
                                 file_size = len(uploaded_file.getvalue())
                                 file_content = f"Binary file: {file_id}, Size: {file_size} bytes. Could not extract content."
+                                index_key = None  # never cache or save an index of a failed extraction
                                 st.sidebar.warning(f"Could not extract text from {file_id}. Please convert to PDF or DOCX format for better results.")
                         else:
                             # For other binary files, create a summary instead of failing
                             file_size = len(uploaded_file.getvalue())
                             file_content = f"Binary file: {file_id}, Size: {file_size} bytes. Could not extract content."
+                            index_key = None  # never cache or save an index of a failed extraction
                             st.sidebar.warning(f"Note: {file_id} appears to be a binary file or uses a non-UTF-8 encoding. Limited context extraction will be available.")
                     except Exception as e:
                         st.sidebar.error(f"Error processing file: {str(e)}")
                         file_content = f"Error processing file {file_id}: {str(e)}"
-            add_documents_to_store(vector_store, [(file_id, file_content, metadata)])
+                        index_key = None  # never cache or save an index of a failed extraction
+            if cached_index is not None:
+                vector_store = cached_index
+            else:
+                vector_store = get_or_build_index(vector_store, index_key, [(file_id, file_content, metadata)])
+            upload_failed = index_key is None
             st.sidebar.success("File uploaded and embedded successfully!")
         
         # Add pack integration (same as in Agent mode)
-        selected_pack = "No Pack"
+        selected_packs = []
         if st.session_state.logged_in:
             packs = get_current_packs()
-            pack_options = ["No Pack"] + [pack["Pack Name"] for pack in packs]
-            selected_pack = st.sidebar.selectbox("Connect to a Pack", pack_options)
-            if selected_pack != "No Pack":
-                selected_pack_info = next(
-                    pack for pack in packs if pack["Pack Name"] == selected_pack
-                )
-                st.session_state.selected_pack_id = selected_pack_info["Pack ID"]
-            else:
-                st.session_state.selected_pack_id = None
-            st.sidebar.write(f"You selected: {selected_pack}")
+            pack_options = [pack["Pack Name"] for pack in packs]
+            selected_packs = st.sidebar.multiselect("Connect to Packs", pack_options)
+            st.session_state.selected_pack_ids = [
+                pack["Pack ID"] for pack in packs if pack["Pack Name"] in selected_packs
+            ]
+            st.sidebar.write(f"You selected: {', '.join(selected_packs) or 'No Pack'}")
         else:
             st.sidebar.info("Login to access your Packs")
         
@@ -1037,52 +1168,44 @@ def main_page():
                 user_id = str(st.session_state.user_info["id"])
                 add_user_message(user_id, standard_chat_query)
             
-            # Search for relevant documents
-            search_results = search_documents(vector_store, standard_chat_query)
-            search_results_content = "\n".join([doc.page_content for doc in search_results])
+            # Search local documents and the selected packs concurrently, reusing
+            # results of a near-duplicate earlier question against the same sources
+            username = st.session_state.user_info.get("username") if st.session_state.logged_in else None
+            retrieved = retrieve(
+                vector_store, standard_chat_query, username, selected_packs,
+                cache_scope=None if upload_failed else semantic_cache_scope(username, selected_packs, index_key),
+            )
+            cache_entry = retrieved["cache_entry"]
+            cached_answer = cache_entry.answers.get(model) if cache_entry and SEMANTIC_CACHE_REUSE_ANSWERS else None
             
-            # Format the query with search results
-            enhanced_query = f"QUERY: {standard_chat_query}\nLOCAL SEARCH RESULTS: {search_results_content}"
+            # Format the query with the best results that fit the model's context budget
+            context = assemble_context(retrieved["local"], retrieved["pack"], token_budget_for(model))
+            enhanced_query = f"QUERY: {standard_chat_query}\nLOCAL SEARCH RESULTS: {context['local']}"
+            if context["pack"]:
+                enhanced_query += f"\nPINECONE PACK RESULTS: {context['pack']}"
             
-            # Add pack results if available
-            if st.session_state.logged_in and selected_pack != "No Pack":
-                username = st.session_state.user_info.get("username")
-                pinecone_results = query_pinecone_pack(username, selected_pack, standard_chat_query)
-                if pinecone_results and isinstance(pinecone_results, dict):
-                    try:
-                        body = json.loads(pinecone_results.get("body", "{}"))
-                        matches = body.get("message", {}).get("matches", [])
-                        pack_texts = []
-                        for match in matches:
-                            if "metadata" in match and "text" in match["metadata"]:
-                                pack_texts.append(match["metadata"]["text"])
-                        if pack_texts:
-                            pack_content = "\n".join(pack_texts)
-                            enhanced_query += f"\nPINECONE PACK RESULTS: {pack_content}"
-                    except json.JSONDecodeError as e:
-                        logging.error(f"Error parsing Pinecone results: {e}")
-            
-            # Generate response using the query_chat function
+            # Stream the response as it is generated (or show the cached answer)
             with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    try:
-                        # Call the query_chat function with the enhanced query
-                        response = query_chat(enhanced_query, model)
-                        
-                        # Display the response
+                try:
+                    if cached_answer:
+                        response = cached_answer
                         st.markdown(response)
-                        
-                        # Add to chat history
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                        
-                        # Save to DynamoDB if logged in
-                        if st.session_state.logged_in:
-                            user_id = str(st.session_state.user_info["id"])
-                            add_ai_message(user_id, response)
-                    except Exception as e:
-                        error_msg = f"Error generating response: {str(e)}"
-                        st.error(error_msg)
-                        logging.error(error_msg)
+                    else:
+                        response = st.write_stream(stream_chat(enhanced_query, model))
+                    if cache_entry is not None and response:
+                        cache_entry.answers[model] = response
+                    
+                    # Add to chat history
+                    st.session_state.messages.append({"role": "assistant", "content": response})
+                    
+                    # Save to DynamoDB if logged in
+                    if st.session_state.logged_in:
+                        user_id = str(st.session_state.user_info["id"])
+                        add_ai_message(user_id, response)
+                except Exception as e:
+                    error_msg = f"Error generating response: {str(e)}"
+                    st.error(error_msg)
+                    logging.error(error_msg)
     elif media_gen_or_text_gen == "Sudo Search":
         st.sidebar.write("Sudo Search options will be displayed here.")
         num_results = st.sidebar.slider(
@@ -1153,31 +1276,27 @@ def main_page():
         if st.session_state.logged_in:
             user_id = str(st.session_state.user_info["id"])
             add_user_message(user_id, prompt)
-        search_results = search_documents(vector_store, prompt)
-        search_results_content = "\n".join([doc.page_content for doc in search_results])
-        agent_prompt = f"PROMPT: {prompt}\nLOCAL SEARCH RESULTS: {search_results_content}"
-        if st.session_state.logged_in and selected_pack != "No Pack":
-            username = st.session_state.user_info.get("username")
-            pinecone_results = query_pinecone_pack(username, selected_pack, prompt)
-            if pinecone_results and isinstance(pinecone_results, dict):
-                try:
-                    body = json.loads(pinecone_results.get("body", "{}"))
-                    matches = body.get("message", {}).get("matches", [])
-                    pack_texts = []
-                    for match in matches:
-                        if "metadata" in match and "text" in match["metadata"]:
-                            pack_texts.append(match["metadata"]["text"])
-                    if pack_texts:
-                        pack_content = "\n".join(pack_texts)
-                        agent_prompt += f"\nPINECONE PACK RESULTS: {pack_content}"
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error parsing Pinecone results: {e}")
+        username = st.session_state.user_info.get("username") if st.session_state.logged_in else None
+        retrieved = retrieve(
+            vector_store, prompt, username, selected_packs,
+            cache_scope=None if upload_failed else semantic_cache_scope(username, selected_packs, index_key),
+        )
+        # Agent answers depend on the conversation thread, so only retrieval results
+        # are reused here, never a cached answer
+        context = assemble_context(retrieved["local"], retrieved["pack"], token_budget_for(model_id))
+        agent_prompt = f"PROMPT: {prompt}\nLOCAL SEARCH RESULTS: {context['local']}"
+        if context["pack"]:
+            agent_prompt += f"\nPINECONE PACK RESULTS: {context['pack']}"
         with st.chat_message("assistant"):
             response_placeholder = st.empty()
             agent_response = ""
-            temp_history = st.session_state.messages.copy()
-            temp_history[-1]["content"] = agent_prompt
-            for chunk in query_agent(agent_executor, temp_history):
+            # The agent keeps the conversation in this session's thread; earlier
+            # messages are only used to seed a thread it does not know yet
+            for chunk in query_agent(
+                agent_executor, prompt, st.session_state.agent_thread_id,
+                history=st.session_state.messages[:-1],
+                augmented_prompt=agent_prompt,
+            ):
                 if chunk["type"] == "response":
                     agent_response += chunk["content"]
                     response_placeholder.markdown(agent_response)
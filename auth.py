@@ -1,13 +1,59 @@
 import streamlit as st
+import base64
+import hashlib
 import json
 import logging
 import os
-import requests
+import threading
+import time
+from cachetools import TLRUCache
+from backend_client import backend
 
 # --- 1) ENSURE CONFIGURATION IS LOADED ---
 # API URL - use environment variable or default to localhost
 API_URL = os.getenv('API_URL', 'http://localhost:5000')
 
+# Validated user info is reused for up to USER_INFO_CACHE_TTL seconds, and never past the token's expiry
+USER_INFO_CACHE_TTL = int(os.getenv('USER_INFO_CACHE_TTL', '300'))
+USER_INFO_CACHE_MAX_ENTRIES = int(os.getenv('USER_INFO_CACHE_MAX_ENTRIES', '4096'))
+
+
+def _user_info_ttu(_key, value, now):
+    # Time-to-use for TLRUCache: the cache TTL, cut short by the token's own expiry
+    ttl = USER_INFO_CACHE_TTL
+    if value["expires_at"] is not None:
+        ttl = min(ttl, value["expires_at"] - time.time())
+    return now + ttl
+
+
+# Access token hash -> {"user_info", "expires_at"}, shared by all sessions in this process
+_user_info_cache = TLRUCache(maxsize=USER_INFO_CACHE_MAX_ENTRIES, ttu=_user_info_ttu)
+_user_info_lock = threading.Lock()
+
+
+def _token_key(access_token):
+    return hashlib.sha256(access_token.encode("utf-8")).hexdigest()
+
+
+def token_expiry(access_token):
+    """Return the exp claim (epoch seconds) of a JWT access token, or None if it has none.
+
+    The signature is not verified here; the backend still validates the token on first use."""
+    try:
+        payload = access_token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, AttributeError):
+        return None
+
+
+def invalidate_user_info(access_token):
+    """Forget the cached user info for access_token (e.g. on logout)."""
+    if access_token:
+        with _user_info_lock:
+            _user_info_cache.pop(_token_key(access_token), None)
+
 def check_token():
     """Check for authentication token in cookies via query parameters.
     This function is used to maintain login state across page refreshes.
@@ -53,8 +99,8 @@ def login_page():
         
         try:
             # Make a request to the API for login
-            response = requests.post(
-                f'{API_URL}/login',
+            response = backend.post(
+                '/login',
                 json={
                     'username': username,
                     'password': password
@@ -92,6 +138,7 @@ def login_page():
 # --- 4) DEFINE LOGOUT ---
 def logout():
     logging.info("User logged out.")
+    invalidate_user_info(st.session_state.get('access_token'))
     st.session_state.logged_in = False
     st.session_state.access_token = None
     st.session_state.username = None
@@ -103,11 +150,27 @@ def logout():
 
 # --- 5) GET USER INFO ---
 def get_user_info(access_token):
+    """Return the user info for access_token, or None if the token is invalid or expired.
+
+    Successful lookups are cached per token (see USER_INFO_CACHE_TTL), so Streamlit
+    reruns and page refreshes do not call the /user endpoint every time."""
+    expires_at = token_expiry(access_token)
+    if expires_at is not None and expires_at <= time.time():
+        logging.info("Access token has expired; not requesting user info.")
+        invalidate_user_info(access_token)
+        return None
+
+    token_key = _token_key(access_token)
+    with _user_info_lock:
+        cached = _user_info_cache.get(token_key)
+    if cached is not None:
+        return dict(cached["user_info"])
+
     try:
         # Make a request to the API to get user info
         headers = {'Authorization': f'Bearer {access_token}'}
         logging.info(f"Requesting user info from {API_URL}/user")
-        response = requests.get(f'{API_URL}/user', headers=headers)
+        response = backend.get('/user', headers=headers)
         
         logging.info(f"User info response status: {response.status_code}")
         
@@ -118,7 +181,9 @@ def get_user_info(access_token):
             # Make sure we have the required fields in user_info
             if 'id' not in user_info and 'user_id' in user_info:
                 user_info['id'] = user_info['user_id']
-                
+
+            with _user_info_lock:
+                _user_info_cache[token_key] = {"user_info": dict(user_info), "expires_at": expires_at}
             return user_info
         else:
             logging.warning(f"Failed to retrieve user info. Status code: {response.status_code}, Response: {response.text}")
@@ -163,8 +228,8 @@ def register_page():
             else:
                 try:
                     # Make a request to the API to register a new user
-                    response = requests.post(
-                        f'{API_URL}/register',
+                    response = backend.post(
+                        '/register',
                         json={
                             'username': username,
                             'email': email,
@@ -0,0 +1,125 @@
+import logging
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# API URL - use environment variable or default to localhost
+API_URL = os.getenv('API_URL', 'http://localhost:5000')
+
+# Connect and read timeouts in seconds for backend API calls
+BACKEND_CONNECT_TIMEOUT = float(os.getenv('BACKEND_CONNECT_TIMEOUT', '3.05'))
+BACKEND_READ_TIMEOUT = float(os.getenv('BACKEND_READ_TIMEOUT', '10'))
+# Keep-alive connections kept per host, shared by all sessions
+BACKEND_POOL_SIZE = int(os.getenv('BACKEND_POOL_SIZE', '20'))
+# Retries for connection errors and 502/503/504 responses, with jittered exponential backoff.
+# Only idempotent methods (GET, HEAD, ...) are retried after the request was sent, so a
+# login or registration is never submitted twice.
+BACKEND_MAX_RETRIES = int(os.getenv('BACKEND_MAX_RETRIES', '3'))
+BACKEND_BACKOFF_FACTOR = float(os.getenv('BACKEND_BACKOFF_FACTOR', '0.3'))
+BACKEND_BACKOFF_JITTER = float(os.getenv('BACKEND_BACKOFF_JITTER', '0.3'))
+
+
+class EndpointMetrics:
+    """Call count, error count and latency totals for one backend endpoint."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, seconds, error):
+        self.calls += 1
+        self.errors += int(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+
+    def as_dict(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "avg_ms": round(1000 * self.total_seconds / self.calls, 1) if self.calls else 0.0,
+            "max_ms": round(1000 * self.max_seconds, 1),
+        }
+
+
+class BackendClient:
+    """
+    HTTP client for the backend API.
+
+    A single requests.Session with a pooled HTTPAdapter is shared by every caller,
+    so connections (and TLS sessions) are reused across Streamlit reruns and users.
+    Every call gets a default (connect, read) timeout and records its latency under
+    "METHOD /path"; see metrics().
+    """
+
+    def __init__(
+        self,
+        base_url=API_URL,
+        timeout=(BACKEND_CONNECT_TIMEOUT, BACKEND_READ_TIMEOUT),
+        pool_size=BACKEND_POOL_SIZE,
+        max_retries=BACKEND_MAX_RETRIES,
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=BACKEND_BACKOFF_FACTOR,
+            backoff_jitter=BACKEND_BACKOFF_JITTER,
+            status_forcelist=(502, 503, 504),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, path, **kwargs):
+        """Send a request to base_url + path and return the requests.Response."""
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = f"{method.upper()} {path}"
+        started = time.perf_counter()
+        error = True
+        try:
+            response = self.session.request(method, f'{self.base_url}{path}', **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._metrics.setdefault(endpoint, EndpointMetrics()).record(elapsed, error)
+            logging.info(f"{endpoint} took {elapsed * 1000:.0f} ms")
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def metrics(self):
+        """Return per-endpoint call counts, server/connection errors and latencies."""
+        with self._lock:
+            return {endpoint: metrics.as_dict() for endpoint, metrics in self._metrics.items()}
+
+
+# Process-wide client shared by auth.py and packs.py
+backend = BackendClient()
+
+
+if __name__ == "__main__":
+    # Example usage
+    try:
+        response = backend.get('/user', headers={'Authorization': 'Bearer invalid'})
+        print(response.status_code)
+    except requests.RequestException as e:
+        print(f"Request failed: {e}")
+    print(backend.metrics())
@@ -1,7 +1,17 @@
-from langchain_community.chat_message_histories import DynamoDBChatMessageHistory
+from langchain_core.messages import AIMessage, HumanMessage
+import atexit
 import boto3
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
 from botocore.exceptions import ClientError
+from cachetools import LRUCache
+from contextlib import contextmanager
 import logging
+import os
+import queue
+import sys
+import threading
+import time
 import streamlit as st
 
 # Configure logging
@@ -20,64 +30,426 @@ session = boto3.Session(
         region_name=REGION,
     )
 
+# Optional endpoint override, e.g. http://localhost:8000 for DynamoDB Local
+DYNAMODB_ENDPOINT_URL = os.getenv('DYNAMODB_ENDPOINT_URL')
 
-def create_dynamodb_table():
-    """Create the DynamoDB table if it doesn't exist."""
-    dynamodb = session.resource("dynamodb")
+# Legacy layout: one item per session holding the whole history list
+LEGACY_TABLE_NAME = "SessionTable"
+# Append-only layout: one item per message, sorted by MessageSeq within a session
+MESSAGES_TABLE_NAME = os.getenv('CHAT_MESSAGES_TABLE', 'ChatMessageTable')
+# Items read per Query page
+DYNAMODB_PAGE_SIZE = int(os.getenv('DYNAMODB_PAGE_SIZE', '100'))
+
+# Chat messages are written by a background thread (write-behind); set to false to write inline
+DYNAMODB_WRITE_BEHIND = os.getenv('DYNAMODB_WRITE_BEHIND', 'true').lower() == 'true'
+# Longest time in seconds a queued message waits before it is written
+DYNAMODB_FLUSH_INTERVAL = float(os.getenv('DYNAMODB_FLUSH_INTERVAL', '0.5'))
+DYNAMODB_WRITE_RETRIES = 5
+DYNAMODB_WRITE_BACKOFF = 0.2
+
+# HTTP connections per pooled resource and the number of idle resources kept for reuse
+DYNAMODB_POOL_SIZE = int(os.getenv('DYNAMODB_POOL_SIZE', '25'))
+DYNAMODB_IDLE_RESOURCES = int(os.getenv('DYNAMODB_IDLE_RESOURCES', '8'))
+# Per-session history handles kept in memory (least recently used are dropped)
+DYNAMODB_HISTORY_HANDLES = int(os.getenv('DYNAMODB_HISTORY_HANDLES', '4096'))
+
+# Keep-alive connections, bounded timeouts and adaptive (client-side rate limited) retries
+dynamodb_config = Config(
+    max_pool_connections=DYNAMODB_POOL_SIZE,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=10,
+    retries={"mode": "adaptive", "max_attempts": 5},
+)
+
+
+class ResourcePool:
+    """
+    Pool of boto3 DynamoDB resources.
+
+    boto3 resources are not thread-safe, and Streamlit runs every rerun on a new
+    thread, so neither one shared resource nor one per thread works. Instead a
+    resource (with its own keep-alive connection pool) is checked out for the
+    duration of an operation and returned afterwards; up to max_idle are kept.
+    """
+
+    def __init__(self, max_idle=DYNAMODB_IDLE_RESOURCES):
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self.created = 0
+
+    def _create(self):
+        self.created += 1
+        return session.resource("dynamodb", endpoint_url=DYNAMODB_ENDPOINT_URL, config=dynamodb_config)
+
+    @contextmanager
+    def resource(self):
+        try:
+            dynamodb = self._idle.get_nowait()
+        except queue.Empty:
+            dynamodb = self._create()
+        try:
+            yield dynamodb
+        finally:
+            try:
+                self._idle.put_nowait(dynamodb)
+            except queue.Full:
+                pass
+
+
+# Process-wide pool shared by all sessions and the history writer thread
+resource_pool = ResourcePool()
+
+
+# Key schema and attribute definitions of every table this module uses
+TABLE_DEFINITIONS = {
+    # Still needed to migrate histories stored in the legacy layout
+    LEGACY_TABLE_NAME: (
+        [{"AttributeName": "SessionId", "KeyType": "HASH"}],
+        [{"AttributeName": "SessionId", "AttributeType": "S"}],
+    ),
+    MESSAGES_TABLE_NAME: (
+        [
+            {"AttributeName": "SessionId", "KeyType": "HASH"},
+            {"AttributeName": "MessageSeq", "KeyType": "RANGE"},
+        ],
+        [
+            {"AttributeName": "SessionId", "AttributeType": "S"},
+            {"AttributeName": "MessageSeq", "AttributeType": "N"},
+        ],
+    ),
+}
+
+# Tables known to exist and be ACTIVE; checked once per process
+_ready_tables = set()
+_tables_lock = threading.Lock()
+
+
+def _create_table(table_name):
+    key_schema, attribute_definitions = TABLE_DEFINITIONS[table_name]
     try:
-        table = dynamodb.create_table(
-            TableName="SessionTable",
-            KeySchema=[{"AttributeName": "SessionId", "KeyType": "HASH"}],
-            AttributeDefinitions=[{"AttributeName": "SessionId", "AttributeType": "S"}],
-            BillingMode="PAY_PER_REQUEST",
-        )
-        table.meta.client.get_waiter("table_exists").wait(TableName="SessionTable")
-        logger.info("DynamoDB table 'SessionTable' created successfully.")
+        with resource_pool.resource() as dynamodb:
+            table = dynamodb.create_table(
+                TableName=table_name,
+                KeySchema=key_schema,
+                AttributeDefinitions=attribute_definitions,
+                BillingMode="PAY_PER_REQUEST",
+            )
+            table.meta.client.get_waiter("table_exists").wait(TableName=table_name)
+        logger.info(f"DynamoDB table '{table_name}' created successfully.")
     except ClientError as e:
         if e.response['Error']['Code'] == 'ResourceInUseException':
-            logger.info("DynamoDB table 'SessionTable' already exists.")
+            logger.info(f"DynamoDB table '{table_name}' already exists.")
         else:
             logger.error(f"Unexpected error: {e}")
             raise
 
-def get_chat_history(session_id):
-    """Retrieve chat history for a given session ID."""
-    history = DynamoDBChatMessageHistory(
-        table_name="SessionTable",
-        session_id=session_id,
-        boto3_session=session
-    )
-    messages = [{"role": message.type, "content": message.content} for message in history.messages]
-    logging.info(f"Chat history for session {session_id}: {messages}")
+def ensure_table(table_name):
+    """
+    Make sure table_name exists and is ACTIVE, creating it if needed.
+
+    The first call in a process issues one DescribeTable (plus CreateTable and a
+    wait if the table is missing or still being created); later calls return
+    immediately without any DynamoDB request.
+    """
+    if table_name in _ready_tables:
+        return
+    with _tables_lock:
+        if table_name in _ready_tables:
+            return
+        try:
+            with resource_pool.resource() as dynamodb:
+                client = dynamodb.meta.client
+                status = client.describe_table(TableName=table_name)["Table"]["TableStatus"]
+                if status != "ACTIVE":
+                    client.get_waiter("table_exists").wait(TableName=table_name)
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceNotFoundException':
+                raise
+            _create_table(table_name)
+        _ready_tables.add(table_name)
+        logger.info(f"DynamoDB table '{table_name}' is ready.")
+
+def ensure_tables():
+    """Make sure every table in TABLE_DEFINITIONS is ready (memoized per process)."""
+    for table_name in TABLE_DEFINITIONS:
+        ensure_table(table_name)
+
+def create_dynamodb_table():
+    """Create the DynamoDB tables if they don't exist."""
+    for table_name in TABLE_DEFINITIONS:
+        _create_table(table_name)
+        _ready_tables.add(table_name)
+
+
+_sequence_lock = threading.Lock()
+_last_sequence = 0
+
+def _next_sequence():
+    """Return a strictly increasing sequence number (microseconds since the epoch)."""
+    global _last_sequence
+    with _sequence_lock:
+        _last_sequence = max(time.time_ns() // 1000, _last_sequence + 1)
+        return _last_sequence
+
+
+class SessionHistory:
+    """Per-session state kept between calls: whether its legacy item was migrated."""
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.migrated = False
+        self.lock = threading.Lock()
+
+
+_history_handles = LRUCache(maxsize=DYNAMODB_HISTORY_HANDLES)
+_handles_lock = threading.Lock()
+
+def _history(session_id):
+    """Return the cached SessionHistory handle for session_id."""
+    with _handles_lock:
+        handle = _history_handles.get(session_id)
+        if handle is None:
+            handle = _history_handles[session_id] = SessionHistory(session_id)
+        return handle
+
+def migrate_legacy_history(session_id, force=False):
+    """
+    Copy a session's legacy SessionTable item into the message table, then delete it.
+
+    Legacy messages get sequence numbers 1..n, so they sort before every message
+    written by the new layout and re-running an interrupted migration overwrites
+    the same items. Each session is checked once per process unless force is set.
+    Returns the number of migrated messages.
+    """
+    handle = _history(session_id)
+    if handle.migrated and not force:
+        return 0
+    ensure_tables()
+    with handle.lock, resource_pool.resource() as dynamodb:
+        legacy_table = dynamodb.Table(LEGACY_TABLE_NAME)
+        item = legacy_table.get_item(Key={"SessionId": session_id}).get("Item")
+        history = item.get("History", []) if item else []
+        if history:
+            with dynamodb.Table(MESSAGES_TABLE_NAME).batch_writer() as batch:
+                for i, message in enumerate(history, start=1):
+                    batch.put_item(Item={
+                        "SessionId": session_id,
+                        "MessageSeq": i,
+                        "Role": message["type"],
+                        "Content": message["data"]["content"],
+                    })
+        if item:
+            legacy_table.delete_item(Key={"SessionId": session_id})
+            logging.info(f"Migrated {len(history)} legacy messages for session {session_id}")
+        handle.migrated = True
+    return len(history)
+
+def migrate_all_legacy_histories():
+    """Migrate every session still stored in the legacy layout. Returns the number of sessions."""
+    ensure_tables()
+    scan_kwargs = {"ProjectionExpression": "SessionId"}
+    migrated = 0
+    while True:
+        with resource_pool.resource() as dynamodb:
+            response = dynamodb.Table(LEGACY_TABLE_NAME).scan(**scan_kwargs)
+        for item in response.get("Items", []):
+            migrate_legacy_history(item["SessionId"], force=True)
+            migrated += 1
+        if "LastEvaluatedKey" not in response:
+            return migrated
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def get_chat_history_page(session_id, limit, before=None):
+    """
+    Retrieve one page of chat history, oldest first.
+
+    Returns the most recent limit messages older than the cursor before (or the
+    most recent overall), read newest first through paginated Queries, and the
+    cursor for the page before them (None when there are no older messages).
+    """
+    # Read our own writes: wait for this session's queued messages first
+    history_writer.flush(session_id)
+    migrate_legacy_history(session_id)
+
+    condition = Key("SessionId").eq(session_id)
+    if before is not None:
+        condition = condition & Key("MessageSeq").lt(before)
+    query_kwargs = {
+        "KeyConditionExpression": condition,
+        "ScanIndexForward": False,
+        "ProjectionExpression": "MessageSeq, #role, #content",
+        "ExpressionAttributeNames": {"#role": "Role", "#content": "Content"},
+    }
+    items = []
+    # Read one extra item to find out whether older messages exist
+    while limit is None or len(items) <= limit:
+        page_size = DYNAMODB_PAGE_SIZE if limit is None else min(DYNAMODB_PAGE_SIZE, limit + 1 - len(items))
+        with resource_pool.resource() as dynamodb:
+            response = dynamodb.Table(MESSAGES_TABLE_NAME).query(Limit=page_size, **query_kwargs)
+        items.extend(response.get("Items", []))
+        if "LastEvaluatedKey" not in response:
+            break
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    cursor = None
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        cursor = items[-1]["MessageSeq"]
+    messages = [{"role": item["Role"], "content": item["Content"]} for item in reversed(items)]
+    logging.info(f"Retrieved {len(messages)} messages for session {session_id}")
+    return messages, cursor
+
+def get_chat_history(session_id, limit=None):
+    """Retrieve chat history for a given session ID, oldest first (only the latest limit messages if given)."""
+    messages, _ = get_chat_history_page(session_id, limit)
     return messages
 
+def _write_messages(session_id, messages):
+    """Append messages to a session's history, one item per message."""
+    ensure_table(MESSAGES_TABLE_NAME)
+    with resource_pool.resource() as dynamodb, dynamodb.Table(MESSAGES_TABLE_NAME).batch_writer() as batch:
+        for message in messages:
+            batch.put_item(Item={
+                "SessionId": session_id,
+                "MessageSeq": _next_sequence(),
+                "Role": message.type,
+                "Content": message.content,
+            })
+    logging.info(f"Wrote {len(messages)} messages to session {session_id}")
+
+
+class ChatHistoryWriter:
+    """
+    Write-behind queue for chat messages.
+
+    Messages are queued per session and written by a background thread at most
+    flush_interval seconds after they were added, so the chat response path never
+    waits on DynamoDB. All pending messages of a session are written in one
+    batch, in the order they were queued. A failed write is retried
+    with backoff before the thread moves on, so a session's messages are never
+    reordered. close() (registered with atexit) writes everything still pending.
+    """
+
+    def __init__(self, write_messages=_write_messages, flush_interval=DYNAMODB_FLUSH_INTERVAL):
+        self.write_messages = write_messages
+        self.flush_interval = flush_interval
+        self._pending = {}  # session id -> messages waiting to be written, oldest first
+        self._in_flight = set()
+        self._flush_requested = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="dynamodb-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, session_id, message):
+        with self._cond:
+            if not self._closed:
+                self._pending.setdefault(session_id, []).append(message)
+                self._cond.notify_all()
+                return
+        # The writer thread is gone (interpreter shutdown); write synchronously
+        self._write_with_retry(session_id, [message])
+
+    def flush(self, session_id=None, timeout=None):
+        """Wait until the pending messages of session_id (or of every session) are written."""
+        def done():
+            if session_id is None:
+                return not self._pending and not self._in_flight
+            return session_id not in self._pending and session_id not in self._in_flight
+
+        with self._cond:
+            if not done():
+                self._flush_requested = True
+                self._cond.notify_all()
+            return self._cond.wait_for(done, timeout=timeout)
+
+    def discard(self, session_id):
+        """Drop a session's unwritten messages and wait for any write already in progress."""
+        with self._cond:
+            self._pending.pop(session_id, None)
+        self.flush(session_id)
+
+    def close(self, timeout=30):
+        """Write everything still pending and stop the background thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return
+                # Give the rest of the turn (e.g. the AI reply) a chance to join the batch
+                self._cond.wait_for(lambda: self._flush_requested or self._closed, timeout=self.flush_interval)
+                batch, self._pending = self._pending, {}
+                self._in_flight = set(batch)
+                self._flush_requested = False
+            for session_id, messages in batch.items():
+                self._write_with_retry(session_id, messages)
+                with self._cond:
+                    self._in_flight.discard(session_id)
+                    self._cond.notify_all()
+
+    def _write_with_retry(self, session_id, messages):
+        for attempt in range(DYNAMODB_WRITE_RETRIES):
+            try:
+                self.write_messages(session_id, messages)
+                return
+            except Exception as e:
+                delay = min(DYNAMODB_WRITE_BACKOFF * 2 ** attempt, 10)
+                logging.warning(f"Writing {len(messages)} messages for session {session_id} failed ({e}); retrying in {delay}s")
+                time.sleep(delay)
+        logging.error(f"Dropped {len(messages)} messages for session {session_id} after {DYNAMODB_WRITE_RETRIES} attempts")
+
+
+# Process-wide writer shared by all sessions
+history_writer = ChatHistoryWriter()
+atexit.register(history_writer.close)
+
+
+def _add_message(session_id, message):
+    if DYNAMODB_WRITE_BEHIND:
+        history_writer.enqueue(session_id, message)
+    else:
+        _write_messages(session_id, [message])
+
 def add_user_message(session_id, message_content):
     """Add a user message to the chat history."""
-    history = DynamoDBChatMessageHistory(
-        table_name="SessionTable",
-        session_id=session_id,
-        boto3_session=session
-    )
-    history.add_user_message(message_content)
+    _add_message(session_id, HumanMessage(content=message_content))
     logging.info(f"Added user message to session {session_id}: {message_content}")
 
 def add_ai_message(session_id, message_content):
     """Add an AI message to the chat history."""
-    history = DynamoDBChatMessageHistory(
-        table_name="SessionTable",
-        session_id=session_id,
-        boto3_session=session
-    )
-    history.add_ai_message(message_content)
+    _add_message(session_id, AIMessage(content=message_content))
     logging.info(f"Added AI message to session {session_id}: {message_content}")
 
 def clear_chat_history(session_id):
     """Clear all chat history for a given session ID."""
     try:
-        dynamodb = session.resource("dynamodb")
-        table = dynamodb.Table("SessionTable")
-        table.delete_item(Key={"SessionId": session_id})
-        
+        # Queued messages must not recreate the history after it is deleted
+        history_writer.discard(session_id)
+        ensure_tables()
+        with resource_pool.resource() as dynamodb:
+            dynamodb.Table(LEGACY_TABLE_NAME).delete_item(Key={"SessionId": session_id})
+            _history(session_id).migrated = True
+
+            table = dynamodb.Table(MESSAGES_TABLE_NAME)
+            query_kwargs = {
+                "KeyConditionExpression": Key("SessionId").eq(session_id),
+                "ProjectionExpression": "SessionId, MessageSeq",
+            }
+            with table.batch_writer() as batch:
+                while True:
+                    response = table.query(**query_kwargs)
+                    for item in response.get("Items", []):
+                        batch.delete_item(Key={"SessionId": item["SessionId"], "MessageSeq": item["MessageSeq"]})
+                    if "LastEvaluatedKey" not in response:
+                        break
+                    query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
         logging.info(f"Chat history cleared for session {session_id}")
         return True
     except Exception as e:
@@ -85,9 +457,14 @@ def clear_chat_history(session_id):
         return False
 
 if __name__ == "__main__":
-    # Create the DynamoDB table
+    # Create the DynamoDB tables
     create_dynamodb_table()
 
+    # python dynamodb.py migrate: move every legacy history to the append-only table
+    if sys.argv[1:] == ["migrate"]:
+        print(f"Migrated {migrate_all_legacy_histories()} sessions")
+        sys.exit()
+
     # Define a test session ID
     session_id = "test_session"
 
@@ -99,7 +476,7 @@ if __name__ == "__main__":
     ai_message = "I'm doing well, thank you! How can I assist you today?"
     add_ai_message(session_id, ai_message)
 
-    # Retrieve and print the chat history
+    # Retrieve and print the chat history (waits for the queued messages)
     chat_history = get_chat_history(session_id)
     print("Chat History:")
     for message in chat_history:
@@ -0,0 +1,179 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# SQLite file holding cached embeddings (shared by every process on the host)
+EMBEDDING_CACHE_PATH = os.getenv(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(tempfile.gettempdir(), 'deepquery_embeddings.sqlite3'),
+)
+# Maximum number of cached vectors before least-recently-used ones are evicted
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '200000'))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def embedding_key(model_id, text, kind="document"):
+    """Return the content-addressed cache key for text embedded by model_id."""
+    return hashlib.sha256(f"{model_id}\x00{kind}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    SQLite-backed store of float32 embedding vectors keyed by embedding_key().
+    Keeps hit/miss counters and evicts least-recently-used rows above max_entries.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logging.info(f"Embedding cache at {path} holds {self._count} vectors.")
+
+    def get_many(self, keys):
+        """Return a dict of key -> vector (list of floats) for the keys present in the cache."""
+        found = {}
+        if not keys:
+            return found
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # Stay well below SQLite's host parameter limit
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._conn.commit()
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs, evicting the least recently used rows if over budget."""
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows
+            )
+            self._count += self._conn.total_changes - before
+            if self._count > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        # Evict down to 90% of the budget so we don't evict on every insert
+        target = int(self.max_entries * 0.9)
+        excess = self._count - target
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+            (excess,),
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logging.info(f"Evicted {excess} vectors from embedding cache; {self._count} remain.")
+
+    def stats(self):
+        """Return hit/miss counters and the current number of cached vectors."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": self._count,
+        }
+
+
+def get_embedding_cache():
+    """Return the process-wide EmbeddingCache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EmbeddingCache()
+        return _cache
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that serves repeated texts from an EmbeddingCache instead of the API."""
+
+    def __init__(self, embeddings, model_id, cache=None):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.cache = cache or get_embedding_cache()
+
+    def embed_documents(self, texts):
+        keys = [embedding_key(self.model_id, text) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed each distinct missing text once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            logging.info(f"Embedding {len(missing)} uncached texts out of {len(texts)}.")
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            new_items = list(zip(missing.keys(), vectors))
+            self.cache.put_many(new_items)
+            found.update(new_items)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = embedding_key(self.model_id, text, kind="query")
+        found = self.cache.get_many([key])
+        if key in found:
+            return found[key]
+        vector = self.embeddings.embed_query(text)
+        self.cache.put_many([(key, vector)])
+        return vector
+
+
+if __name__ == "__main__":
+    # Example usage with a fake embedder to show hit/miss accounting
+    class _LengthEmbeddings(Embeddings):
+        def embed_documents(self, texts):
+            return [[float(len(text)), 1.0] for text in texts]
+
+        def embed_query(self, text):
+            return [float(len(text)), 1.0]
+
+    cache = EmbeddingCache(path=":memory:", max_entries=10)
+    embeddings = CachedEmbeddings(_LengthEmbeddings(), "example-model", cache=cache)
+    embeddings.embed_documents(["hello", "world", "hello"])
+    embeddings.embed_documents(["hello", "again"])
+    print(cache.stats())
@@ -0,0 +1,77 @@
+import io
+import json
+import logging
+import re
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# In-memory pack contents: (username, pack_name) -> list of chunk texts
+PACKS = {}
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def add_pack(username, pack_name, texts):
+    """Register the chunks of a pack with the fake handler."""
+    PACKS[(username, pack_name)] = list(texts)
+
+
+def _query_pack(username, pack_name, query, top_k=5):
+    """Score a pack's chunks by term overlap with query, shaped like the real Pinecone response."""
+    if (username, pack_name) not in PACKS:
+        return {"statusCode": 404, "body": json.dumps({"message": f"Pack '{pack_name}' not found"})}
+    query_terms = set(_TOKEN_PATTERN.findall(query.lower()))
+    matches = []
+    for i, text in enumerate(PACKS[(username, pack_name)]):
+        terms = set(_TOKEN_PATTERN.findall(text.lower()))
+        score = len(query_terms & terms) / (len(query_terms) or 1)
+        matches.append({"id": f"{pack_name}-{i}", "score": score, "metadata": {"text": text}})
+    matches.sort(key=lambda match: match["score"], reverse=True)
+    return {"statusCode": 200, "body": json.dumps({"message": {"matches": matches[:top_k]}})}
+
+
+def lambda_handler(event, context=None):
+    """Local stand-in for the pinecone-embedding Lambda supporting query_pack and query_pack_batch."""
+    body = event.get("body", {})
+    if isinstance(body, str):
+        body = json.loads(body)
+    action = body.get("action")
+    username = body.get("username")
+
+    if action == "query_pack":
+        return _query_pack(username, body.get("pack_name"), body.get("query", ""))
+    if action == "query_pack_batch":
+        results = [_query_pack(username, item.get("pack_name"), item.get("query", "")) for item in body.get("queries", [])]
+        return {"statusCode": 200, "body": json.dumps({"results": results})}
+    return {"statusCode": 400, "body": json.dumps({"message": f"Unknown action: {action}"})}
+
+
+class FakeLambdaClient:
+    """Drop-in for the boto3 Lambda client's invoke() that runs lambda_handler in-process."""
+
+    def __init__(self):
+        self.invocations = 0
+
+    def invoke(self, FunctionName, InvocationType="RequestResponse", Payload="{}", **kwargs):
+        self.invocations += 1
+        result = lambda_handler(json.loads(Payload))
+        return {"StatusCode": 200, "Payload": io.BytesIO(json.dumps(result).encode("utf-8"))}
+
+
+if __name__ == "__main__":
+    # Example usage
+    add_pack("newuser", "My Custom Pack", ["Elon Musk is the CEO of SpaceX.", "Pinecone is a vector database."])
+    client = FakeLambdaClient()
+    payload = {
+        "body": {
+            "action": "query_pack_batch",
+            "username": "newuser",
+            "queries": [
+                {"pack_name": "My Custom Pack", "query": "who is elon musk?"},
+                {"pack_name": "My Custom Pack", "query": "what is pinecone?"},
+            ],
+        }
+    }
+    response = client.invoke(FunctionName="fake", Payload=json.dumps(payload))
+    print(json.loads(response["Payload"].read()))
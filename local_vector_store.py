@@ -1,37 +1,567 @@
+import hashlib
+import json
 import logging
-from langchain_core.vectorstores import InMemoryVectorStore
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from botocore.exceptions import ClientError
+from langchain_core.vectorstores import VectorStore
 from langchain_aws.embeddings.bedrock import BedrockEmbeddings
 from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from embedding_cache import CachedEmbeddings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Embedding and splitter settings. These are part of the index cache key, so
+# changing any of them invalidates previously built indexes.
+EMBEDDING_MODEL_ID = 'amazon.titan-embed-text-v1'
+EMBEDDING_REGION = 'us-east-1'  # Specify your AWS region
+CHUNK_SIZE = 4000  # Smaller than the 8192 token limit
+CHUNK_OVERLAP = 200
+
+# Concurrent embedding settings (Titan v1 embeds one text per request)
+EMBEDDING_MAX_WORKERS = int(os.getenv('EMBEDDING_MAX_WORKERS', '8'))
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', '8'))
+EMBEDDING_MAX_RETRIES = int(os.getenv('EMBEDDING_MAX_RETRIES', '5'))
+EMBEDDING_BACKOFF_BASE = 0.5  # seconds
+EMBEDDING_BACKOFF_CAP = 20.0  # seconds
+
+# Error codes Bedrock returns when we should back off and retry
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+}
+
+# Approximate memory budget for built indexes kept by an IndexCache
+INDEX_CACHE_MAX_BYTES = int(os.getenv('INDEX_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+# Directory holding saved indexes, one subdirectory per index cache key
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(tempfile.gettempdir(), 'deepquery_indexes'))
+# Disk budget for INDEX_DIR; the least recently used indexes are removed above it
+INDEX_DIR_MAX_BYTES = int(os.getenv('INDEX_DIR_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+
+# Approximate nearest neighbour (IVF) settings. Stores with at least
+# ANN_MIN_CHUNKS chunks search the ANN_NPROBE closest inverted lists instead
+# of scanning every row; raise ANN_NPROBE for recall, lower it for latency.
+# benchmark_ann() (30k chunks x 1536 dims, 173 lists) measured:
+#   exact        recall@5=1.00  17.2 ms/query
+#   nprobe=8     recall@5=0.85   2.0 ms/query
+#   nprobe=16    recall@5=0.89   3.6 ms/query
+#   nprobe=32    recall@5=0.91  13.3 ms/query
+# At document-chat sizes exact search costs far less than the Bedrock query
+# embedding, so ANN is effectively off by default: it only kicks in for stores
+# of a million chunks, where an exact scan reads ~6 GB per query. Lower
+# ANN_MIN_CHUNKS to opt in to trading recall for latency.
+ANN_MIN_CHUNKS = int(os.getenv('ANN_MIN_CHUNKS', '1000000'))
+ANN_NPROBE = int(os.getenv('ANN_NPROBE', '8'))
+ANN_KMEANS_ITERATIONS = 8
+ANN_TRAINING_SAMPLES_PER_LIST = 32
+
+# Hybrid retrieval settings: BM25 parameters, candidates taken from each
+# ranker, and the reciprocal rank fusion constant.
+BM25_K1 = 1.5
+BM25_B = 0.75
+HYBRID_CANDIDATES = int(os.getenv('HYBRID_CANDIDATES', '20'))
+RRF_K = 60
+# Approximate CPython cost of one BM25 posting (its postings dict entry; the term
+# string and Counter table are measured directly) and of one document's
+# bookkeeping entries, used for nbytes; checked against tracemalloc.
+BM25_POSTING_BYTES = 32
+BM25_DOC_OVERHEAD_BYTES = 250
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def _tokenize(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+class BM25Index:
+    """Inverted index scoring chunks with Okapi BM25, keyed by document id."""
+
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self._doc_terms = {}  # doc_id -> Counter of terms, needed for removal
+        self._doc_lengths = {}
+        self._total_length = 0
+        self._doc_bytes = {}  # doc_id -> approximate bytes held for it, see nbytes
+
+    def __len__(self):
+        return len(self._doc_terms)
+
+    @property
+    def nbytes(self):
+        """Approximate memory held by the postings, term Counters and document lengths."""
+        return sum(self._doc_bytes.values())
+
+    def add(self, doc_ids, texts):
+        for doc_id, text in zip(doc_ids, texts):
+            terms = Counter(_tokenize(text))
+            self._doc_terms[doc_id] = terms
+            self._doc_lengths[doc_id] = sum(terms.values())
+            self._total_length += self._doc_lengths[doc_id]
+            # Counter table and its term strings, plus one posting entry per term
+            doc_bytes = sys.getsizeof(terms) + BM25_DOC_OVERHEAD_BYTES
+            for term, freq in terms.items():
+                self._postings[term][doc_id] = freq
+                doc_bytes += sys.getsizeof(term) + BM25_POSTING_BYTES
+            self._doc_bytes[doc_id] = doc_bytes
+
+    def remove(self, doc_ids):
+        for doc_id in doc_ids:
+            terms = self._doc_terms.pop(doc_id, None)
+            if terms is None:
+                continue
+            self._total_length -= self._doc_lengths.pop(doc_id)
+            self._doc_bytes.pop(doc_id)
+            for term in terms:
+                postings = self._postings[term]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+
+    def copy(self):
+        """Return an independent copy; the per-document Counters are never mutated, so they are shared."""
+        clone = BM25Index(self.k1, self.b)
+        clone._postings = defaultdict(dict, ((term, dict(postings)) for term, postings in self._postings.items()))
+        clone._doc_terms = dict(self._doc_terms)
+        clone._doc_lengths = dict(self._doc_lengths)
+        clone._total_length = self._total_length
+        clone._doc_bytes = dict(self._doc_bytes)
+        return clone
+
+    def search(self, query, k):
+        """Return up to k (doc_id, score) pairs for documents sharing terms with query, best first."""
+        n_docs = len(self._doc_terms)
+        if not n_docs or k <= 0:
+            return []
+        avg_length = self._total_length / n_docs
+        scores = defaultdict(float)
+        for term in set(_tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = np.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, freq in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * freq * (self.k1 + 1) / (freq + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k]
+
+def _top_k(scores, k):
+    """Return the indices of the k highest scores, best first."""
+    if k < len(scores):
+        top = np.argpartition(-scores, k)[:k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top])]
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over L2-normalized vectors.
+    A spherical k-means coarse quantizer assigns each row to one of n_lists
+    centroids; a query only scores the rows in its nprobe closest lists.
+    """
+
+    def __init__(self, n_lists, nprobe=ANN_NPROBE, iterations=ANN_KMEANS_ITERATIONS, seed=0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._lists = None  # (row order grouped by list, list start offsets)
+
+    def train(self, vectors):
+        """Fit centroids on a sample of vectors, then assign every row."""
+        rng = np.random.default_rng(self.seed)
+        sample_size = min(len(vectors), self.n_lists * ANN_TRAINING_SAMPLES_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, self.n_lists, replace=False)].copy()
+        for _ in range(self.iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(self.n_lists):
+                members = sample[labels == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+                else:
+                    # Re-seed empty lists so every centroid stays useful
+                    centroids[c] = sample[rng.integers(sample_size)]
+            centroids = NumpyVectorStore._normalize(centroids)
+        self.centroids = centroids
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.add(vectors)
+
+    def add(self, vectors):
+        """Assign newly appended rows to their nearest centroid."""
+        labels = np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+        self.assignments = np.concatenate([self.assignments, labels])
+        self._lists = None
+
+    def remove_rows(self, keep):
+        """Drop assignments for removed rows (keep is the store's compaction mask)."""
+        self.assignments = self.assignments[keep]
+        self._lists = None
+
+    def candidates(self, query, nprobe=None):
+        """Return the row numbers in the nprobe lists closest to query."""
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength=self.n_lists))])
+            self._lists = (order, offsets)
+        order, offsets = self._lists
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probe = _top_k(self.centroids @ query, nprobe)
+        return np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probe])
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store that keeps embeddings in a contiguous float32 NumPy matrix with
+    L2-normalized rows, so a query is one matrix-vector product plus argpartition.
+    Supports incremental appends and deletes by document id or file_id.
+    """
+
+    def __init__(self, embedding, ann_min_chunks=ANN_MIN_CHUNKS, nprobe=ANN_NPROBE):
+        self.embedding = embedding
+        self.ann_min_chunks = ann_min_chunks
+        self.nprobe = nprobe
+        self._matrix = np.empty((0, 0), dtype=np.float32)  # Rows beyond _size are spare capacity
+        self._size = 0
+        self._ids = []
+        self._texts = []
+        self._metadatas = []
+        self._ann = None
+        self._ann_trained_size = 0
+        self._bm25 = BM25Index()  # None until first use for stores loaded from disk
+        self._shared_bm25 = None  # _SharedBM25 of the saved index this store was loaded from
+        self._row_by_id = None
+        self._lock = threading.RLock()
+
+    @property
+    def embeddings(self):
+        return self.embedding
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def vectors(self):
+        """The normalized embedding matrix (a view, one row per chunk)."""
+        return self._matrix[:self._size]
+
+    def memory_bytes(self):
+        """Approximate memory held by the vectors, texts and BM25 index."""
+        if isinstance(self._texts, _MappedTexts):
+            total = self._matrix.nbytes + self._texts.nbytes
+        else:
+            total = self._matrix.nbytes + sum(len(text) for text in self._texts)
+        if self._bm25 is not None:
+            total += self._bm25.nbytes
+        elif self._shared_bm25 is not None:
+            total += self._shared_bm25.nbytes
+        return total
+
+    def _materialize(self):
+        """Copy memory-mapped (read-only) columns and the shared BM25 index into private memory before the first write."""
+        if isinstance(self._matrix, np.memmap):
+            self._matrix = np.array(self._matrix[:self._size])
+        if not isinstance(self._texts, list):
+            self._texts = list(self._texts)
+            self._ids = list(self._ids)
+            self._metadatas = list(self._metadatas)
+        if self._shared_bm25 is not None:
+            self._bm25 = self._ensure_bm25().copy()
+            self._shared_bm25 = None
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def _reserve(self, extra_rows, dim):
+        needed = self._size + extra_rows
+        if self._matrix.shape[1] not in (0, dim):
+            raise ValueError(f"Embedding dimension {dim} does not match store dimension {self._matrix.shape[1]}.")
+        if needed <= self._matrix.shape[0] and self._matrix.shape[1] == dim:
+            return
+        # Grow geometrically so repeated appends are amortized O(1) per row
+        capacity = max(needed, 2 * self._matrix.shape[0], 64)
+        grown = np.empty((capacity, dim), dtype=np.float32)
+        if self._size:
+            grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        """Add texts with precomputed embeddings and return their ids."""
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1))
+        metadatas = metadatas or [{} for _ in texts]
+        ids = [doc_id or str(uuid.uuid4()) for doc_id in (ids or [None] * len(texts))]
+        if not len(metadatas) == len(ids) == len(texts):
+            raise ValueError("texts, embeddings, metadatas and ids must have the same length.")
+
+        with self._lock:
+            self._materialize()
+            self._ensure_bm25().add(ids, texts)
+            if self._row_by_id is not None:
+                self._row_by_id.update((doc_id, self._size + i) for i, doc_id in enumerate(ids))
+            self._reserve(len(texts), vectors.shape[1])
+            self._matrix[self._size:self._size + len(texts)] = vectors
+            self._size += len(texts)
+            if self._ann is not None:
+                if self._size > 2 * self._ann_trained_size:
+                    # The centroids were fit on a much smaller corpus; retrain on next query
+                    self._ann = None
+                else:
+                    self._ann.add(vectors)
+            self._ids.extend(ids)
+            self._texts.extend(texts)
+            self._metadatas.extend(metadatas)
+        return ids
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        texts = list(texts)
+        vectors = self.embedding.embed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas=metadatas, ids=ids)
+
+    def _delete_rows(self, keep):
+        """Compact the store down to the rows where keep is True; returns the number removed."""
+        removed = int(self._size - keep.sum())
+        if removed:
+            self._materialize()
+            if self._ann is not None:
+                self._ann.remove_rows(keep)
+            self._ensure_bm25().remove([self._ids[i] for i in np.flatnonzero(~keep)])
+            self._row_by_id = None
+            kept_rows = np.flatnonzero(keep)
+            self._matrix[:len(kept_rows)] = self._matrix[kept_rows]
+            self._size = len(kept_rows)
+            self._ids = [self._ids[i] for i in kept_rows]
+            self._texts = [self._texts[i] for i in kept_rows]
+            self._metadatas = [self._metadatas[i] for i in kept_rows]
+        return removed
+
+    def delete(self, ids=None, **kwargs):
+        if ids is None:
+            return False
+        id_set = set(ids)
+        with self._lock:
+            keep = np.array([doc_id not in id_set for doc_id in self._ids], dtype=bool)
+            return self._delete_rows(keep) > 0
+
+    def delete_by_file_id(self, file_id):
+        """Remove every chunk that came from file_id; returns the number of chunks removed."""
+        with self._lock:
+            keep = np.array([metadata.get("file_id") != file_id for metadata in self._metadatas], dtype=bool)
+            removed = self._delete_rows(keep)
+        logging.info(f"Removed {removed} chunks for file {file_id}.")
+        return removed
+
+    def _ensure_bm25(self):
+        if self._bm25 is None:
+            if self._shared_bm25 is not None:
+                # Read-only until _materialize copies it
+                self._bm25 = self._shared_bm25.index
+            else:
+                logging.info(f"Building BM25 index over {self._size} chunks.")
+                self._bm25 = BM25Index()
+                self._bm25.add(self._ids, self._texts)
+        return self._bm25
+
+    def lexical_search_rows(self, query, k=4):
+        """Return (rows, scores) for the k best BM25 matches for query."""
+        with self._lock:
+            matches = self._ensure_bm25().search(query, k)
+            if self._row_by_id is None:
+                self._row_by_id = {doc_id: row for row, doc_id in enumerate(self._ids)}
+            rows = np.array([self._row_by_id[doc_id] for doc_id, _ in matches], dtype=np.int64)
+            scores = np.array([score for _, score in matches], dtype=np.float32)
+            return rows, scores
+
+    def hybrid_search_with_score(self, query, k=4, candidates=HYBRID_CANDIDATES):
+        """
+        Fuse vector and BM25 rankings with reciprocal rank fusion.
+        Returns up to k (Document, fused score) pairs, best first.
+        """
+        query_vector = self.embedding.embed_query(query)
+        with self._lock:
+            n_candidates = max(k, candidates)
+            vector_rows, _ = self.search_rows(query_vector, n_candidates)
+            lexical_rows, _ = self.lexical_search_rows(query, n_candidates)
+            fused = defaultdict(float)
+            for rows in (vector_rows, lexical_rows):
+                for rank, row in enumerate(rows.tolist()):
+                    fused[row] += 1.0 / (RRF_K + rank + 1)
+            ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(self._document(row), score) for row, score in ranked]
+
+    def _document(self, row):
+        return Document(id=self._ids[row], page_content=self._texts[row], metadata=self._metadatas[row])
+
+    def get_by_ids(self, ids):
+        rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        return [self._document(rows[doc_id]) for doc_id in ids if doc_id in rows]
+
+    def _ensure_ann(self):
+        if self._ann is None:
+            n_lists = max(1, int(np.sqrt(self._size)))
+            logging.info(f"Training IVF index with {n_lists} lists over {self._size} chunks.")
+            self._ann = IVFIndex(n_lists, nprobe=self.nprobe)
+            self._ann.train(self.vectors)
+            self._ann_trained_size = self._size
+        return self._ann
+
+    def search_rows(self, embedding, k=4, exact=False, nprobe=None):
+        """
+        Return (rows, scores) for the k most similar chunks to embedding.
+        Uses the IVF index once the store reaches ann_min_chunks unless exact is True.
+        """
+        with self._lock:
+            if self._size == 0 or k <= 0:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            query = self._normalize(np.asarray(embedding, dtype=np.float32))
+            if not exact and self._size >= self.ann_min_chunks:
+                candidates = self._ensure_ann().candidates(query, nprobe)
+                scores = self._matrix[candidates] @ query
+                top = _top_k(scores, k)
+                return candidates[top], scores[top]
+            scores = self.vectors @ query
+            top = _top_k(scores, k)
+            return top, scores[top]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, exact=False, nprobe=None, **kwargs):
+        """Return the k most similar documents to embedding with their cosine similarity."""
+        with self._lock:
+            rows, scores = self.search_rows(embedding, k, exact=exact, nprobe=nprobe)
+            return [(self._document(row), float(score)) for row, score in zip(rows, scores)]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, **kwargs):
+        store = cls(embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
 def create_vector_store():
-    """Initialize and return an InMemoryVectorStore with Bedrock embeddings."""
+    """Initialize and return a NumpyVectorStore with cached Bedrock embeddings."""
     logging.info("Initializing Bedrock embeddings.")
-    embeddings = BedrockEmbeddings(
-        model_id='amazon.titan-embed-text-v1',
-        region_name='us-east-1',  # Specify your AWS region
+    embeddings = CachedEmbeddings(
+        BedrockEmbeddings(
+            model_id=EMBEDDING_MODEL_ID,
+            region_name=EMBEDDING_REGION,
+        ),
+        model_id=EMBEDDING_MODEL_ID,
     )
-    logging.info("Creating InMemoryVectorStore.")
-    return InMemoryVectorStore(embeddings)
+    logging.info("Creating NumpyVectorStore.")
+    return NumpyVectorStore(embeddings)
 
-def add_documents_to_store(vector_store, file_contents):
+def _is_throttling_error(error):
+    """Return True if error is a Bedrock throttling/availability error worth retrying."""
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+    return any(code in str(error) for code in THROTTLING_ERROR_CODES)
+
+def _embed_batch_with_retry(embeddings, texts, max_retries):
+    """Embed a batch of texts, backing off exponentially (with jitter) when throttled."""
+    for attempt in range(max_retries + 1):
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries or not _is_throttling_error(e):
+                raise
+            delay = min(EMBEDDING_BACKOFF_CAP, EMBEDDING_BACKOFF_BASE * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+            logging.warning(f"Embedding throttled (attempt {attempt + 1}/{max_retries}); retrying in {delay:.2f}s.")
+            time.sleep(delay)
+
+def embed_documents_concurrently(
+    embeddings,
+    texts,
+    max_workers=EMBEDDING_MAX_WORKERS,
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_retries=EMBEDDING_MAX_RETRIES,
+    progress_callback=None,
+):
+    """
+    Embed texts in batches on a bounded thread pool, preserving input order.
+
+    Args:
+        embeddings: The Embeddings object used for each batch
+        texts: List of texts to embed
+        max_workers: Maximum number of concurrent embedding requests
+        batch_size: Number of texts handed to each worker call
+        max_retries: Retries per batch on throttling errors
+        progress_callback: Optional callable(done, total), invoked on the calling thread
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    if not batches:
+        return []
+
+    results = [None] * len(batches)
+    done = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as executor:
+        futures = {
+            executor.submit(_embed_batch_with_retry, embeddings, batch, max_retries): i
+            for i, batch in enumerate(batches)
+        }
+        try:
+            for future in as_completed(futures):
+                i = futures[future]
+                results[i] = future.result()
+                done += len(batches[i])
+                if progress_callback:
+                    progress_callback(done, len(texts))
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+    return [vector for batch_vectors in results for vector in batch_vectors]
+
+def add_documents_to_store(vector_store, file_contents, progress_callback=None, max_workers=EMBEDDING_MAX_WORKERS):
     """
     Add documents to the vector store from file contents.
-    Documents are split into chunks before embedding.
+    Documents are split into chunks and embedded concurrently.
     
     Args:
         vector_store: The vector store to add documents to
         file_contents: List of tuples (file_id, content, metadata)
+        progress_callback: Optional callable(done, total) reporting embedded chunks
+        max_workers: Maximum number of concurrent embedding requests
     """
     logging.info("Adding documents to the vector store.")
     
     # Initialize text splitter
     text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=4000,  # Smaller than the 8192 token limit
-        chunk_overlap=200,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
         length_function=len,
     )
     
@@ -54,18 +584,368 @@ def add_documents_to_store(vector_store, file_contents):
         ]
         all_documents.extend(chunk_docs)
     
-    # Add the chunked documents to the vector store
-    vector_store.add_documents(documents=all_documents)
+    # Embed the chunks concurrently, then add them to the vector store
+    vectors = embed_documents_concurrently(
+        vector_store.embedding,
+        [doc.page_content for doc in all_documents],
+        max_workers=max_workers,
+        progress_callback=progress_callback,
+    )
+    vector_store.add_embeddings(
+        [doc.page_content for doc in all_documents],
+        vectors,
+        metadatas=[doc.metadata for doc in all_documents],
+    )
     logging.info(f"Added {len(all_documents)} document chunks successfully.")
 
-def search_documents(vector_store, query, k=1):
-    """Search for documents similar to the query."""
-    logging.info(f"Performing similarity search for query: {query}")
-    results = vector_store.similarity_search(query=query, k=k)
+def search_documents_with_scores(vector_store, query, k=4):
+    """
+    Search for documents relevant to the query, returning (Document, score) pairs.
+    NumpyVectorStores fuse embedding similarity with BM25 keyword matches, so exact
+    identifiers, names and numbers are found even when their embeddings are not close.
+    """
+    logging.info(f"Performing hybrid search for query: {query}")
+    if isinstance(vector_store, NumpyVectorStore):
+        results = vector_store.hybrid_search_with_score(query, k=k)
+    else:
+        results = vector_store.similarity_search_with_score(query=query, k=k)
     logging.info(f"Search completed. Found {len(results)} results.")
     return results
 
-if __name__ == "__main__":
+def search_documents(vector_store, query, k=1):
+    """Search for documents relevant to the query."""
+    return [doc for doc, _ in search_documents_with_scores(vector_store, query, k=k)]
+
+class _MappedTexts:
+    """Read-only sequence of chunk texts decoded on demand from a memory-mapped UTF-8 blob."""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, row):
+        return bytes(self._blob[self._offsets[row]:self._offsets[row + 1]]).decode("utf-8")
+
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+
+    @property
+    def nbytes(self):
+        return len(self._blob)
+
+class _Sidecar:
+    """Metadata sidecar of a saved index, parsed on first access and shared by every loaded copy."""
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._lock = threading.Lock()
+
+    @property
+    def data(self):
+        with self._lock:
+            if self._data is None:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._data = json.load(f)
+            return self._data
+
+class _SharedBM25:
+    """BM25 index of a saved index, built on first use and shared read-only by every loaded copy."""
+
+    def __init__(self, texts, sidecar):
+        self._texts = texts
+        self._sidecar = sidecar
+        self._index = None
+        self._lock = threading.Lock()
+
+    @property
+    def index(self):
+        with self._lock:
+            if self._index is None:
+                logging.info(f"Building shared BM25 index over {len(self._texts)} chunks.")
+                index = BM25Index()
+                index.add(self._sidecar.data["ids"], self._texts)
+                self._index = index
+            return self._index
+
+    @property
+    def nbytes(self):
+        """Bytes held by the built index, or 0 before it is built."""
+        index = self._index
+        return index.nbytes if index is not None else 0
+
+class _SidecarColumn:
+    """Read-only per-chunk view (ids or metadatas) over a _Sidecar."""
+
+    def __init__(self, sidecar, size, column):
+        self._sidecar = sidecar
+        self._size = size
+        self._column = column
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, row):
+        data = self._sidecar.data
+        if self._column == "ids":
+            return data["ids"][row]
+        metadata = dict(data["files"][data["file_refs"][row]])
+        if data["chunk_index"][row] is not None:
+            metadata["chunk_index"] = data["chunk_index"][row]
+        return metadata
+
+    def __iter__(self):
+        return (self[row] for row in range(self._size))
+
+def index_path(index_key):
+    """Return the directory a saved index for index_key lives in."""
+    return os.path.join(INDEX_DIR, index_key)
+
+def save_vector_store(vector_store, path):
+    """
+    Save a NumpyVectorStore to directory path:
+      vectors.npy   float32 (n, dim) normalized embeddings
+      texts.bin     UTF-8 chunk texts, concatenated
+      offsets.npy   int64 (n + 1) byte offsets of each text in texts.bin
+      metadata.json ids, per-chunk file reference and chunk_index, per-file metadata
+      ivf_*.npy     IVF centroids and assignments, if the ANN index was trained
+    The directory is written under a temporary name and renamed into place.
+    """
+    with vector_store._lock:
+        encoded = [text.encode("utf-8") for text in vector_store._texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(blob) for blob in encoded], out=offsets[1:])
+
+        files, file_refs, chunk_indexes = [], [], []
+        file_lookup = {}
+        for metadata in vector_store._metadatas:
+            file_metadata = {key: value for key, value in metadata.items() if key != "chunk_index"}
+            file_key = json.dumps(file_metadata, sort_keys=True, default=str)
+            if file_key not in file_lookup:
+                file_lookup[file_key] = len(files)
+                files.append(file_metadata)
+            file_refs.append(file_lookup[file_key])
+            chunk_indexes.append(metadata.get("chunk_index"))
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, "vectors.npy"), np.ascontiguousarray(vector_store.vectors))
+        np.save(os.path.join(tmp_path, "offsets.npy"), offsets)
+        with open(os.path.join(tmp_path, "texts.bin"), "wb") as f:
+            for blob in encoded:
+                f.write(blob)
+        with open(os.path.join(tmp_path, "metadata.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {"ids": list(vector_store._ids), "files": files, "file_refs": file_refs, "chunk_index": chunk_indexes},
+                f,
+                default=str,
+            )
+        if vector_store._ann is not None:
+            np.save(os.path.join(tmp_path, "ivf_centroids.npy"), vector_store._ann.centroids)
+            np.save(os.path.join(tmp_path, "ivf_assignments.npy"), vector_store._ann.assignments)
+
+    try:
+        os.rename(tmp_path, path)
+        logging.info(f"Saved index with {len(encoded)} chunks to {path}.")
+    except OSError:
+        # Another session saved the same index first; theirs is identical
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def _directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def prune_index_dir(index_dir=INDEX_DIR, max_bytes=INDEX_DIR_MAX_BYTES, keep=()):
+    """
+    Remove the least recently used saved indexes until index_dir fits in max_bytes.
+
+    An index's directory mtime is its last use (load_vector_store touches it).
+    Paths in keep are never removed. Returns the number of indexes removed.
+    """
+    try:
+        names = os.listdir(index_dir)
+    except FileNotFoundError:
+        return 0
+    indexes = []
+    for name in names:
+        path = os.path.join(index_dir, name)
+        if ".tmp-" in name or not os.path.isdir(path):
+            continue  # an index still being written
+        try:
+            indexes.append((os.path.getmtime(path), path, _directory_bytes(path)))
+        except OSError:
+            continue
+    total = sum(size for _, _, size in indexes)
+    removed = 0
+    for _, path, size in sorted(indexes):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        with _mapped_indexes_lock:
+            _mapped_indexes.pop(path, None)
+        total -= size
+        removed += 1
+    if removed:
+        logging.info(f"Removed {removed} saved indexes; {index_dir} now holds ~{total} bytes.")
+    return removed
+
+_mapped_indexes = {}
+_mapped_indexes_lock = threading.Lock()
+
+def _map_index(path):
+    """Memory-map the files of a saved index once per process."""
+    with _mapped_indexes_lock:
+        mapped = _mapped_indexes.get(path)
+        if mapped is None:
+            vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+            offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+            texts_path = os.path.join(path, "texts.bin")
+            if os.path.getsize(texts_path):
+                blob = np.memmap(texts_path, dtype=np.uint8, mode="r")
+            else:
+                blob = np.empty(0, dtype=np.uint8)
+            ivf = None
+            if os.path.exists(os.path.join(path, "ivf_centroids.npy")):
+                ivf = (
+                    np.load(os.path.join(path, "ivf_centroids.npy"), mmap_mode="r"),
+                    np.load(os.path.join(path, "ivf_assignments.npy"), mmap_mode="r"),
+                )
+            texts = _MappedTexts(blob, offsets)
+            sidecar = _Sidecar(os.path.join(path, "metadata.json"))
+            mapped = (vectors, texts, sidecar, ivf, _SharedBM25(texts, sidecar))
+            _mapped_indexes[path] = mapped
+        return mapped
+
+def load_vector_store(path, embedding):
+    """
+    Open a saved index as a NumpyVectorStore without reading it into memory.
+    Vectors and texts are memory-mapped read-only and shared by every store loaded
+    from the same path in this process, as is the BM25 index built on the first
+    hybrid search; a store copies them on its first write.
+    Returns None if no index is saved at path.
+    """
+    if not os.path.exists(os.path.join(path, "metadata.json")):
+        return None
+    try:
+        os.utime(path)  # mark as recently used for prune_index_dir
+    except OSError:
+        pass
+    vectors, texts, sidecar, ivf, shared_bm25 = _map_index(path)
+    store = NumpyVectorStore(embedding)
+    store._matrix = vectors
+    store._size = len(vectors)
+    store._texts = texts
+    store._ids = _SidecarColumn(sidecar, store._size, "ids")
+    store._metadatas = _SidecarColumn(sidecar, store._size, "metadatas")
+    store._bm25 = None
+    store._shared_bm25 = shared_bm25
+    if ivf is not None:
+        centroids, assignments = ivf
+        store._ann = IVFIndex(len(centroids), nprobe=store.nprobe)
+        store._ann.centroids = centroids
+        store._ann.assignments = assignments
+        store._ann_trained_size = store._size
+    logging.info(f"Loaded index with {store._size} chunks from {path}.")
+    return store
+
+def index_cache_key(file_bytes):
+    """Return the index cache key for file_bytes under the current splitter/embedding settings."""
+    digest = hashlib.sha256(file_bytes)
+    digest.update(f"|{EMBEDDING_MODEL_ID}|{CHUNK_SIZE}|{CHUNK_OVERLAP}".encode("utf-8"))
+    return digest.hexdigest()
+
+def estimate_store_bytes(vector_store):
+    """Roughly estimate the memory held by a built vector store."""
+    return vector_store.memory_bytes()
+
+class IndexCache:
+    """
+    LRU cache of built vector stores keyed by index_cache_key().
+    Entries are evicted least-recently-used first once their estimated size exceeds max_bytes.
+    """
+
+    def __init__(self, max_bytes=INDEX_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (vector_store, size_bytes)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached vector store for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, vector_store):
+        """Cache vector_store under key, evicting older entries to stay within budget."""
+        size = estimate_store_bytes(vector_store)
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (vector_store, size)
+            self._total_bytes += size
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evicted_size
+                logging.info(f"Evicted index {evicted_key[:12]} ({evicted_size} bytes) from index cache.")
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+def benchmark_ann(n_chunks=30000, dim=1536, n_queries=100, k=5, nprobes=(1, 4, 8, 16, 32), seed=0):
+    """
+    Compare IVF search against exact search on synthetic clustered vectors.
+    Prints recall@k and mean query latency for each nprobe setting.
+    """
+    rng = np.random.default_rng(seed)
+    centers = 0.5 * rng.standard_normal((max(1, n_chunks // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=n_chunks)]
+    vectors += rng.standard_normal((n_chunks, dim)).astype(np.float32)
+    queries = vectors[rng.choice(n_chunks, n_queries, replace=False)]
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32)
+
+    store = NumpyVectorStore(embedding=None, ann_min_chunks=0)
+    store.add_embeddings([str(i) for i in range(n_chunks)], vectors)
+
+    start = time.perf_counter()
+    exact = [set(store.search_rows(q, k, exact=True)[0].tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) / n_queries * 1000
+    print(f"exact: recall@{k}=1.000, {exact_ms:.2f} ms/query")
+
+    start = time.perf_counter()
+    store._ensure_ann()
+    print(f"IVF training: {time.perf_counter() - start:.2f} s ({store._ann.n_lists} lists)")
+
+    for nprobe in nprobes:
+        start = time.perf_counter()
+        approx = [set(store.search_rows(q, k, nprobe=nprobe)[0].tolist()) for q in queries]
+        ann_ms = (time.perf_counter() - start) / n_queries * 1000
+        recall = np.mean([len(a & e) / len(e) for a, e in zip(approx, exact)])
+        print(f"nprobe={nprobe}: recall@{k}={recall:.3f}, {ann_ms:.2f} ms/query")
+
+if __name__ == "__main__" and sys.argv[1:] == ["benchmark"]:
+    benchmark_ann()
+elif __name__ == "__main__":
     # Example usage
     vector_store = create_vector_store()
     
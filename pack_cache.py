@@ -0,0 +1,180 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from cachetools import TTLCache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Pack query results are reused for PACK_CACHE_TTL seconds
+PACK_CACHE_TTL = int(os.getenv('PACK_CACHE_TTL', '600'))
+PACK_CACHE_MAX_ENTRIES = int(os.getenv('PACK_CACHE_MAX_ENTRIES', '1024'))
+# Optional SQLite file shared by every worker process on the host
+PACK_CACHE_DB = os.getenv('PACK_CACHE_DB')
+
+
+def normalize_query(query):
+    """Normalize case and whitespace so trivially different phrasings share a cache entry."""
+    return " ".join(query.lower().split())
+
+
+class SQLiteCacheBackend:
+    """
+    Small key-value store on SQLite implementing the subset of the Redis client API
+    used by PackQueryCache (get, set with ex, delete, incr), so a redis.Redis
+    instance can be swapped in for multi-host deployments.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires_at = row
+            if expires_at is not None and expires_at < time.time():
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            return value
+
+    def set(self, key, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        expires_at = time.time() + ex if ex else None
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)", (key, value, expires_at)
+            )
+            self._conn.commit()
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            deleted = 0
+            for key in keys:
+                deleted += self._conn.execute("DELETE FROM cache WHERE key = ?", (key,)).rowcount
+            self._conn.commit()
+            return deleted
+
+    def incr(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            value = int(row[0]) + 1 if row else 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, NULL)",
+                (key, str(value).encode("utf-8")),
+            )
+            self._conn.commit()
+            return value
+
+
+class PackQueryCache:
+    """
+    TTL + LRU cache of pack query responses keyed by (user, pack, normalized query).
+
+    Entries live in an in-process TTLCache and, when a backend is given, in the
+    shared backend too. Each (user, pack) has a generation counter that is part of
+    the key; invalidate() bumps it, which orphans every cached result for that pack
+    in all processes sharing the backend.
+    """
+
+    def __init__(self, ttl=PACK_CACHE_TTL, max_entries=PACK_CACHE_MAX_ENTRIES, backend=None):
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._local = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._generations = {}
+        self._lock = threading.Lock()
+
+    def _generation(self, username, pack_name):
+        if self.backend is not None:
+            value = self.backend.get(f"packgen:{username}:{pack_name}")
+            return int(value) if value else 0
+        return self._generations.get((username, pack_name), 0)
+
+    def generation(self, username, pack_name):
+        """Return the invalidation counter of one of a user's packs (bumped by invalidate())."""
+        with self._lock:
+            if self.backend is None:
+                return self._generations.get((username, pack_name), 0)
+        return self._generation(username, pack_name)
+
+    def _key(self, username, pack_name, query):
+        digest = hashlib.sha256(normalize_query(query).encode("utf-8")).hexdigest()
+        return f"packq:{username}:{pack_name}:{self._generation(username, pack_name)}:{digest}"
+
+    def get(self, username, pack_name, query):
+        """Return the cached response for the query, or None."""
+        key = self._key(username, pack_name, query)
+        with self._lock:
+            entry = self._local.get(key)
+        if entry is None and self.backend is not None:
+            raw = self.backend.get(key)
+            if raw is not None:
+                stored = json.loads(raw)
+                entry = (stored["payload"], stored["latency"])
+                with self._lock:
+                    self._local[key] = entry
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.saved_seconds += entry[1]
+        return entry[0]
+
+    def put(self, username, pack_name, query, payload, latency):
+        """Cache a response along with the latency it took to produce."""
+        key = self._key(username, pack_name, query)
+        with self._lock:
+            self._local[key] = (payload, latency)
+        if self.backend is not None:
+            self.backend.set(key, json.dumps({"payload": payload, "latency": latency}), ex=self.ttl)
+
+    def invalidate(self, username, pack_name):
+        """Forget every cached result for one of a user's packs."""
+        prefix = f"packq:{username}:{pack_name}:"
+        with self._lock:
+            for key in [key for key in self._local if key.startswith(prefix)]:
+                self._local.pop(key, None)
+            self._generations[(username, pack_name)] = self._generations.get((username, pack_name), 0) + 1
+        if self.backend is not None:
+            self.backend.incr(f"packgen:{username}:{pack_name}")
+        logging.info(f"Invalidated cached results for pack '{pack_name}' of user {username}.")
+
+    def stats(self):
+        """Return hit/miss counters, hit ratio and the total Lambda latency saved."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": len(self._local),
+        }
+
+
+if __name__ == "__main__":
+    # Example usage with a local SQLite backend
+    cache = PackQueryCache(ttl=60, backend=SQLiteCacheBackend(":memory:"))
+    cache.put("newuser", "My Custom Pack", "Who is Elon Musk?", {"body": "{}"}, latency=1.8)
+    print(cache.get("newuser", "My Custom Pack", "  who is  elon musk? "))
+    cache.invalidate("newuser", "My Custom Pack")
+    print(cache.get("newuser", "My Custom Pack", "who is elon musk?"))
+    print(cache.stats())
@@ -1,9 +1,17 @@
+import asyncio
 import boto3
+import hashlib
 import json
 import logging
 import streamlit as st
 import os
-import requests
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+from cachetools import TTLCache
+from backend_client import backend
+from pack_cache import PackQueryCache, SQLiteCacheBackend, PACK_CACHE_DB
 
 # Initialize a session using Boto3 for remaining Lambda functions
 ACCESS_KEY = st.secrets["default"]["ACCESS_KEY"]
@@ -22,30 +30,113 @@ session = boto3.Session(
 # API URL
 API_URL = os.getenv('API_URL', 'http://localhost:5000')
 
-# Create a Lambda client for pinecone queries
-lambda_client = session.client('lambda')
+# Pack lists are reused for PACK_LIST_TTL seconds, then revalidated with If-None-Match
+PACK_LIST_TTL = int(os.getenv('PACK_LIST_TTL', '60'))
+
+# Access token hash -> {"packs", "etag", "fetched_at"}; kept past PACK_LIST_TTL for revalidation
+_pack_list_cache = TTLCache(maxsize=1024, ttl=3600)
+_pack_list_lock = threading.Lock()
+
+# Lambda function that embeds queries and searches Pinecone
+PACK_LAMBDA_FUNCTION = 'pinecone-embedding-HelloWorldFunction-tHPspSqIP5SE'
+
+# Lambda connection pool size and per-call deadline (seconds) for pack queries
+PACK_LAMBDA_POOL_SIZE = int(os.getenv('PACK_LAMBDA_POOL_SIZE', '32'))
+PACK_QUERY_DEADLINE = float(os.getenv('PACK_QUERY_DEADLINE', '20'))
+# Number of matches kept after merging results from several packs
+PACK_MERGED_TOP_K = int(os.getenv('PACK_MERGED_TOP_K', '10'))
+
+# One pooled client is shared by every session: keep-alive connections, enough of
+# them for concurrent sessions, and adaptive (client-side rate limited) retries
+lambda_config = Config(
+    max_pool_connections=PACK_LAMBDA_POOL_SIZE,
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=PACK_QUERY_DEADLINE,
+    retries={"mode": "adaptive", "max_attempts": 3},
+)
+
+# Create a Lambda client for pinecone queries (PACK_LAMBDA_FAKE=true runs a local fake instead)
+if os.getenv('PACK_LAMBDA_FAKE', 'false').lower() == 'true':
+    from fake_pack_lambda import FakeLambdaClient
+    lambda_client = FakeLambdaClient()
+else:
+    lambda_client = session.client('lambda', config=lambda_config)
+
+# Threads that run blocking Lambda calls for the asyncio API, sized to the connection pool
+_lambda_executor = ThreadPoolExecutor(max_workers=PACK_LAMBDA_POOL_SIZE, thread_name_prefix="pack-lambda")
+
+# Set when the deployed Lambda rejected query_pack_batch; batches are then sent as
+# single queries until the action is probed again after PACK_BATCH_RETRY_AFTER seconds
+PACK_BATCH_RETRY_AFTER = int(os.getenv('PACK_BATCH_RETRY_AFTER', '3600'))
+_batch_unsupported_since = None
+
+# Cache of pack query results, optionally shared between worker processes
+pack_query_cache = PackQueryCache(backend=SQLiteCacheBackend(PACK_CACHE_DB) if PACK_CACHE_DB else None)
+
+# Last seen fingerprint of each (username, pack name), used to detect modified packs
+_pack_fingerprints = {}
+
+
+def _invalidate_modified_packs(username, packs):
+    """Drop cached query results for packs whose details changed since we last listed them."""
+    for pack in packs:
+        fingerprint = json.dumps(pack, sort_keys=True, default=str)
+        key = (username, pack.get('pack_name'))
+        previous = _pack_fingerprints.get(key)
+        _pack_fingerprints[key] = fingerprint
+        if previous is not None and previous != fingerprint:
+            pack_query_cache.invalidate(username, pack.get('pack_name'))
+
+
+def invalidate_pack_cache(username, pack_name):
+    """Forget cached query results for a pack, e.g. after it has been modified."""
+    pack_query_cache.invalidate(username, pack_name)
+
+
+def pack_cache_generations(username, pack_names):
+    """Return the invalidation counters of the given packs, for keying caches built on pack results."""
+    return tuple(pack_query_cache.generation(username, pack_name) for pack_name in pack_names)
+
+def get_pack_cache_stats():
+    """Return hit ratio and saved latency of the pack query cache."""
+    return pack_query_cache.stats()
 
 # Function to fetch current packs
-def get_current_packs():
+def get_current_packs(force_refresh=False):
     # Check if user is logged in and access token is available
     if not st.session_state.logged_in or not st.session_state.access_token:
         logging.warning("User not logged in or access token not available")
         return []
+
+    # Serve the cached list while it is fresh (Streamlit reruns on every interaction)
+    token_key = hashlib.sha256(st.session_state.access_token.encode("utf-8")).hexdigest()
+    with _pack_list_lock:
+        cached = _pack_list_cache.get(token_key)
+    if cached and not force_refresh and time.monotonic() - cached["fetched_at"] < PACK_LIST_TTL:
+        return cached["packs"]
     
     logging.info(f"Getting packs for user: {st.session_state.get('username', 'Unknown')}")
     logging.info(f"Access token: {st.session_state.access_token[:10]}... (truncated)")
     
     try:
-        # Make a request to the API to get user packs
+        # Make a request to the API to get user packs, revalidating the cached list if we have one
         headers = {'Authorization': f'Bearer {st.session_state.access_token}'}
+        if cached and cached["etag"]:
+            headers['If-None-Match'] = cached["etag"]
         logging.info(f"Making request to {API_URL}/user/packs")
         
-        response = requests.get(f'{API_URL}/user/packs', headers=headers)
+        response = backend.get('/user/packs', headers=headers)
         logging.info(f"Pack API response status: {response.status_code}")
+
+        if response.status_code == 304 and cached:
+            cached["fetched_at"] = time.monotonic()
+            return cached["packs"]
         
         if response.status_code == 200:
             packs = response.json()
             logging.info(f"Retrieved {len(packs)} packs")
+            _invalidate_modified_packs(st.session_state.get('username'), packs)
             
             # Transform the data to match the expected format
             formatted_packs = []
@@ -56,6 +147,12 @@ def get_current_packs():
                     'Date Created': pack['date_created'].split('T')[0] if 'T' in pack['date_created'] else pack['date_created'],
                     'Pack ID': pack['id']
                 })
+            with _pack_list_lock:
+                _pack_list_cache[token_key] = {
+                    "packs": formatted_packs,
+                    "etag": response.headers.get('ETag'),
+                    "fetched_at": time.monotonic(),
+                }
             return formatted_packs
         else:
             logging.error(f"Failed to fetch packs: {response.text}")
@@ -70,6 +167,11 @@ def query_pinecone_pack(username, pack_name, query):
     # Return None immediately if "No Pack" is selected
     if pack_name == "No Pack":
         return None
+
+    cached = pack_query_cache.get(username, pack_name, query)
+    if cached is not None:
+        logging.info(f"Pack query cache hit for pack '{pack_name}'")
+        return cached
     
     # Define the payload for the Lambda function
     payload = {
@@ -83,8 +185,9 @@ def query_pinecone_pack(username, pack_name, query):
 
     try:
         # Invoke the Lambda function
+        started = time.monotonic()
         response = lambda_client.invoke(
-            FunctionName='pinecone-embedding-HelloWorldFunction-tHPspSqIP5SE',
+            FunctionName=PACK_LAMBDA_FUNCTION,
             InvocationType='RequestResponse',
             Payload=json.dumps(payload)
         )
@@ -99,6 +202,9 @@ def query_pinecone_pack(username, pack_name, query):
             logging.error("Error in Lambda invocation: %s", response_payload['errorMessage'])
             return None
 
+        # Only cache successful lookups; e.g. a 404 for a pack that is being created must not stick
+        if response_payload.get("statusCode") == 200:
+            pack_query_cache.put(username, pack_name, query, response_payload, time.monotonic() - started)
         return response_payload
 
     except Exception as e:
@@ -106,7 +212,165 @@ def query_pinecone_pack(username, pack_name, query):
         return None
 
 
+def query_pinecone_packs_batch(username, pack_queries):
+    """
+    Query several (pack_name, query) pairs with a single Lambda invocation.
+
+    Returns a list of responses aligned with pack_queries, each shaped like a
+    query_pinecone_pack() response (None for "No Pack" entries and failures).
+    Cached results are served without being sent. If the deployed Lambda does not
+    support the batch action, the remaining queries are sent one at a time, and
+    the batch action is not tried again for PACK_BATCH_RETRY_AFTER seconds.
+    """
+    global _batch_unsupported_since
+    results = [None] * len(pack_queries)
+    pending = []
+    for i, (pack_name, query) in enumerate(pack_queries):
+        if pack_name == "No Pack":
+            continue
+        cached = pack_query_cache.get(username, pack_name, query)
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    if _batch_unsupported_since is not None and time.monotonic() - _batch_unsupported_since < PACK_BATCH_RETRY_AFTER:
+        return _query_pending_singly(username, pack_queries, pending, results)
+
+    payload = {
+        "body": {
+            "action": "query_pack_batch",
+            "username": username,
+            "queries": [
+                {"pack_name": pack_queries[i][0], "query": pack_queries[i][1]} for i in pending
+            ]
+        }
+    }
+
+    try:
+        started = time.monotonic()
+        response = lambda_client.invoke(
+            FunctionName=PACK_LAMBDA_FUNCTION,
+            InvocationType='RequestResponse',
+            Payload=json.dumps(payload)
+        )
+        response_payload = json.loads(response['Payload'].read())
+    except Exception as e:
+        # Transport failure: says nothing about batch support
+        logging.warning("Batched pack query failed (%s); falling back to single queries", e)
+        return _query_pending_singly(username, pack_queries, pending, results)
+    latency = time.monotonic() - started
+
+    batch_results = None
+    try:
+        if 'errorMessage' not in response_payload and response_payload.get("statusCode", 200) == 200:
+            batch_results = json.loads(response_payload.get("body", "{}")).get("results")
+    except (AttributeError, json.JSONDecodeError):
+        pass
+    if not isinstance(batch_results, list) or len(batch_results) != len(pending):
+        _batch_unsupported_since = time.monotonic()
+        logging.warning("Lambda does not support query_pack_batch (%s); sending single queries", response_payload)
+        return _query_pending_singly(username, pack_queries, pending, results)
+
+    _batch_unsupported_since = None
+    logging.info(f"Batched {len(pending)} pack queries in one Lambda invocation ({latency:.2f}s)")
+    for i, result in zip(pending, batch_results):
+        # Only successful results are returned and cached (not e.g. a 404 for a missing pack)
+        if isinstance(result, dict) and 'errorMessage' not in result and result.get("statusCode") == 200:
+            results[i] = result
+            pack_name, query = pack_queries[i]
+            pack_query_cache.put(username, pack_name, query, result, latency / len(pending))
+    return results
+
+
+def _query_pending_singly(username, pack_queries, pending, results):
+    for i in pending:
+        pack_name, query = pack_queries[i]
+        results[i] = query_pinecone_pack(username, pack_name, query)
+    return results
+
+
+async def _run_with_deadline(func, *args, deadline=PACK_QUERY_DEADLINE):
+    """Run a blocking pack call on the Lambda thread pool, giving up after deadline seconds."""
+    loop = asyncio.get_running_loop()
+    try:
+        return await asyncio.wait_for(loop.run_in_executor(_lambda_executor, func, *args), timeout=deadline)
+    except asyncio.TimeoutError:
+        logging.warning(f"Pack query missed its {deadline}s deadline")
+        return None
+
+
+async def aquery_pinecone_pack(username, pack_name, query, deadline=PACK_QUERY_DEADLINE):
+    """Asyncio version of query_pinecone_pack() with a per-call deadline (None on timeout)."""
+    return await _run_with_deadline(query_pinecone_pack, username, pack_name, query, deadline=deadline)
+
+
+async def aquery_pinecone_packs_batch(username, pack_queries, deadline=PACK_QUERY_DEADLINE):
+    """Asyncio version of query_pinecone_packs_batch() with a per-call deadline."""
+    results = await _run_with_deadline(query_pinecone_packs_batch, username, pack_queries, deadline=deadline)
+    return results if results is not None else [None] * len(pack_queries)
+
+
+def extract_pack_matches(response_payload):
+    """
+    Extract the matched chunks from a query_pinecone_pack() response.
+    Returns a list of {"text": ..., "score": ...} dicts (empty on errors).
+    """
+    if not response_payload or not isinstance(response_payload, dict):
+        return []
+    try:
+        body = json.loads(response_payload.get("body", "{}"))
+    except json.JSONDecodeError as e:
+        logging.error(f"Error parsing Pinecone results: {e}")
+        return []
+    # Error responses carry a plain string message
+    message = body.get("message") if isinstance(body, dict) else None
+    matches = message.get("matches", []) if isinstance(message, dict) else []
+    return [
+        {"text": match["metadata"]["text"], "score": match.get("score", 0.0)}
+        for match in matches
+        if "metadata" in match and "text" in match["metadata"]
+    ]
+
+
+async def _aquery_pack_matches(username, pack_names, query):
+    responses = await asyncio.gather(
+        *(aquery_pinecone_pack(username, pack_name, query) for pack_name in pack_names)
+    )
+    return [extract_pack_matches(response) for response in responses]
+
+
+def query_pinecone_packs(username, pack_names, query, top_k=PACK_MERGED_TOP_K):
+    """
+    Query several packs in parallel and merge their matches into one ranked list.
+
+    Every pack is searched with the same query embedding and index, so the raw
+    Pinecone (cosine) scores are comparable across packs and are merged as is.
+    Returns up to top_k {"text", "score", "pack_name"} dicts, best first.
+    """
+    pack_names = [pack_name for pack_name in pack_names if pack_name != "No Pack"]
+    if not pack_names:
+        return []
+    per_pack = asyncio.run(_aquery_pack_matches(username, pack_names, query))
+
+    merged = [
+        {**match, "pack_name": pack_name}
+        for pack_name, matches in zip(pack_names, per_pack)
+        for match in matches
+    ]
+    merged.sort(key=lambda match: match["score"], reverse=True)
+    logging.info(f"Merged {len(merged)} matches from {len(pack_names)} packs")
+    return merged[:top_k]
+
+
 if __name__ == "__main__":
     print(get_current_packs())
 
     print(query_pinecone_pack("newuser", "My Custom Pack", "who is elon musk?"))
+
+    print(query_pinecone_packs_batch("newuser", [
+        ("My Custom Pack", "who is elon musk?"),
+        ("My Custom Pack", "what is a vector database?"),
+    ]))
@@ -0,0 +1,207 @@
+import hashlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from local_vector_store import CHUNK_OVERLAP, search_documents_with_scores
+from packs import pack_cache_generations, query_pinecone_packs
+from semantic_cache import semantic_cache
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Rough characters-per-token ratio for English text (avoids a tokenizer download)
+CHARS_PER_TOKEN = 4
+
+# Token budget for retrieved context per model, leaving room for the question,
+# the chat history and the answer
+DEFAULT_CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+MODEL_CONTEXT_TOKEN_BUDGETS = {
+    "anthropic.claude-3-5-sonnet-20240620-v1:0": 8000,
+    "cohere.command-r-plus-v1:0": 6000,
+    "meta/meta-llama-3-8b-instruct": 3000,
+    "anthropic/claude-3.5-haiku": 8000,
+    "deepseek-ai/deepseek-r1": 6000,
+}
+
+# Number of local chunks considered for packing
+LOCAL_CONTEXT_CANDIDATES = int(os.getenv('LOCAL_CONTEXT_CANDIDATES', '8'))
+
+# Per-source retrieval deadlines in seconds; a source that misses its deadline
+# contributes no results instead of delaying the answer
+LOCAL_SEARCH_TIMEOUT = float(os.getenv('LOCAL_SEARCH_TIMEOUT', '10'))
+PACK_QUERY_TIMEOUT = float(os.getenv('PACK_QUERY_TIMEOUT', '20'))
+RETRIEVAL_MAX_WORKERS = int(os.getenv('RETRIEVAL_MAX_WORKERS', '16'))
+
+# Shared by all sessions; retrieval legs are I/O bound
+_executor = ThreadPoolExecutor(max_workers=RETRIEVAL_MAX_WORKERS, thread_name_prefix="retrieval")
+
+# Shortest shared text treated as a splitter overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+
+
+def estimate_tokens(text):
+    """Approximate the number of tokens in text."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def token_budget_for(model_id):
+    """Return the context token budget for model_id."""
+    return MODEL_CONTEXT_TOKEN_BUDGETS.get(model_id, DEFAULT_CONTEXT_TOKEN_BUDGET)
+
+
+def _overlap_length(first, second):
+    """Length of the longest suffix of first that is a prefix of second (splitter overlap)."""
+    longest = min(len(first), len(second), 2 * CHUNK_OVERLAP)
+    for length in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _fingerprint(text):
+    return hashlib.sha1(" ".join(text.split()).lower().encode("utf-8")).hexdigest()
+
+
+def _normalized(items):
+    """Scale scores to [0, 1] within one source so local and pack results can be interleaved."""
+    top = max((score for _, score in items), default=0) or 1.0
+    return [(item, score / top) for item, score in items]
+
+
+def assemble_context(local_results, pack_matches, token_budget):
+    """
+    Greedily pack the highest-scoring retrieved content into token_budget tokens.
+
+    Args:
+        local_results: List of (Document, score) pairs from the local vector store
+        pack_matches: List of dicts with "text" and "score" keys from a pack query
+        token_budget: Maximum number of (estimated) tokens of context to return
+
+    Returns a dict with the packed "local" and "pack" text and the estimated "tokens" used.
+    Exact duplicates are dropped, and text shared by adjacent chunks of the same file
+    (the splitter's overlap window) is only included once.
+    """
+    candidates = [("local", doc, score) for doc, score in _normalized(local_results)]
+    candidates += [
+        ("pack", match, score)
+        for match, score in _normalized([(match, match.get("score", 0.0)) for match in pack_matches])
+    ]
+    candidates.sort(key=lambda candidate: candidate[2], reverse=True)
+
+    selected_local = {}  # (file_id, chunk_index) -> trimmed text
+    selected_pack = []
+    seen = set()
+    used = 0
+    for source, item, _ in candidates:
+        text = item.page_content if source == "local" else item.get("text", "")
+        fingerprint = _fingerprint(text)
+        if not text.strip() or fingerprint in seen:
+            continue
+
+        if source == "local":
+            file_id = item.metadata.get("file_id")
+            chunk_index = item.metadata.get("chunk_index")
+            if chunk_index is not None:
+                previous = selected_local.get((file_id, chunk_index - 1))
+                following = selected_local.get((file_id, chunk_index + 1))
+                if previous:
+                    text = text[_overlap_length(previous, text):]
+                if following:
+                    text = text[:len(text) - _overlap_length(text, following)]
+
+        tokens = estimate_tokens(text)
+        if used + tokens > token_budget:
+            continue
+        used += tokens
+        seen.add(fingerprint)
+        if source == "local":
+            key = (file_id, chunk_index if chunk_index is not None else len(selected_local))
+            selected_local[key] = text
+        else:
+            selected_pack.append(text)
+
+    # Emit local chunks in document order so trimmed neighbours read continuously
+    local_keys = sorted(selected_local, key=lambda key: (str(key[0]), key[1]))
+    local_text = ""
+    for i, key in enumerate(local_keys):
+        if i and local_keys[i - 1] == (key[0], key[1] - 1):
+            local_text += selected_local[key]
+        else:
+            local_text += ("\n" if local_text else "") + selected_local[key]
+
+    logging.info(
+        f"Packed {len(selected_local)} local and {len(selected_pack)} pack results "
+        f"into ~{used}/{token_budget} tokens."
+    )
+    return {"local": local_text, "pack": "\n".join(selected_pack), "tokens": used}
+
+
+def retrieve(
+    vector_store,
+    query,
+    username=None,
+    pack_names=(),
+    local_k=LOCAL_CONTEXT_CANDIDATES,
+    local_timeout=LOCAL_SEARCH_TIMEOUT,
+    pack_timeout=PACK_QUERY_TIMEOUT,
+    cache_scope=None,
+):
+    """
+    Run the local search and the (multi-)pack query concurrently.
+
+    Each source is given its own deadline, measured from when retrieval started,
+    so the total wait is the slowest source rather than the sum. Sources that fail
+    or miss their deadline contribute no results and are listed in "failed".
+
+    If cache_scope is given (a hashable naming the user, pack and attached files),
+    results for a semantically near-duplicate earlier query in the same scope are
+    reused without querying either source. The packs' cache generations are part
+    of the scope, so invalidating a pack also retires results built from it.
+
+    Returns a dict with "local" ((Document, score) pairs), "pack" (match dicts),
+    "failed" (names of sources without results) and "cache_entry" (the
+    SemanticCacheEntry holding these results, or None), whose answers may be
+    filled in once the LLM has responded.
+    """
+    started = time.monotonic()
+    # The pack query does not need the query embedding, so it starts right away and
+    # overlaps the embedding call of the cache lookup; on a cache hit it is dropped
+    pack_future = None
+    if username and pack_names:
+        pack_future = _executor.submit(query_pinecone_packs, username, list(pack_names), query)
+
+    query_vector = None
+    if cache_scope is not None:
+        cache_scope = (cache_scope, pack_cache_generations(username, pack_names) if username else ())
+        query_vector = vector_store.embedding.embed_query(query)
+        entry = semantic_cache.lookup(cache_scope, query_vector)
+        if entry is not None:
+            if pack_future is not None:
+                pack_future.cancel()
+            return {**entry.results, "failed": [], "cache_entry": entry}
+
+    # The local search reuses the query embedding through the embedding cache
+    sources = {"local": (_executor.submit(search_documents_with_scores, vector_store, query, local_k), local_timeout)}
+    if pack_future is not None:
+        sources["pack"] = (pack_future, pack_timeout)
+
+    results = {"local": [], "pack": [], "failed": [], "cache_entry": None}
+    for name, (future, timeout) in sources.items():
+        remaining = max(0.0, started + timeout - time.monotonic())
+        try:
+            results[name] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            logging.warning(f"Retrieval source '{name}' missed its {timeout}s deadline; continuing without it.")
+            results["failed"].append(name)
+        except Exception as e:
+            logging.error(f"Retrieval source '{name}' failed: {e}", exc_info=True)
+            results["failed"].append(name)
+
+    logging.info(f"Retrieval finished in {time.monotonic() - started:.2f}s.")
+    # Only cache complete results so a timed-out source is retried next time
+    if query_vector is not None and not results["failed"]:
+        results["cache_entry"] = semantic_cache.store(
+            cache_scope, query, query_vector, {"local": results["local"], "pack": results["pack"]}
+        )
+    return results
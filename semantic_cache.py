@@ -0,0 +1,134 @@
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Cosine similarity above which two queries are treated as the same question
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.92'))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', '5000'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '3600'))
+# Also reuse the final LLM answer for near-duplicate questions (skips the LLM call).
+# Only Standard Chat reuses answers; Agent answers depend on the conversation thread
+SEMANTIC_CACHE_REUSE_ANSWERS = os.getenv('SEMANTIC_CACHE_REUSE_ANSWERS', 'false').lower() == 'true'
+
+
+class SemanticCacheEntry:
+    """A previously answered query with its retrieval results and final answers per model."""
+
+    def __init__(self, query, results):
+        self.query = query
+        self.results = results
+        self.answers = {}  # model id -> final answer
+        self.created = time.time()
+        self.last_used = self.created
+
+
+class SemanticCache:
+    """
+    Cache of retrieval results keyed by query embedding.
+
+    Entries are grouped by scope (e.g. user, pack and attached files), so results
+    are only reused for the same sources. A lookup returns the most similar earlier
+    query in the scope if its cosine similarity reaches the threshold. Entries expire
+    after ttl seconds and the least recently used are evicted above max_entries.
+    """
+
+    def __init__(self, threshold=SEMANTIC_CACHE_THRESHOLD, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, ttl=SEMANTIC_CACHE_TTL):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._scopes = {}  # scope -> (normalized vector matrix, list of entries)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, scope, query_vector, threshold=None):
+        """Return the best matching SemanticCacheEntry for query_vector in scope, or None."""
+        threshold = self.threshold if threshold is None else threshold
+        with self._lock:
+            self._expire_locked(scope)
+            vectors, entries = self._scopes.get(scope, (None, []))
+            if not entries:
+                self.misses += 1
+                return None
+            similarities = vectors @ self._normalize(query_vector)
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = entries[best]
+            entry.last_used = time.time()
+            logging.info(f"Semantic cache hit ({similarities[best]:.3f}) for earlier query: {entry.query}")
+            return entry
+
+    def store(self, scope, query, query_vector, results):
+        """Remember results for query in scope and return the new entry."""
+        entry = SemanticCacheEntry(query, results)
+        vector = self._normalize(query_vector)[np.newaxis, :]
+        with self._lock:
+            vectors, entries = self._scopes.get(scope, (None, []))
+            vectors = vector if vectors is None else np.vstack([vectors, vector])
+            self._scopes[scope] = (vectors, entries + [entry])
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict_locked()
+        return entry
+
+    def _remove_locked(self, scope, keep):
+        vectors, entries = self._scopes[scope]
+        kept = [entry for entry, kept_entry in zip(entries, keep) if kept_entry]
+        self._count -= len(entries) - len(kept)
+        if kept:
+            self._scopes[scope] = (vectors[np.asarray(keep)], kept)
+        else:
+            del self._scopes[scope]
+
+    def _expire_locked(self, scope):
+        if scope not in self._scopes:
+            return
+        cutoff = time.time() - self.ttl
+        keep = [entry.created >= cutoff for entry in self._scopes[scope][1]]
+        if not all(keep):
+            self._remove_locked(scope, keep)
+
+    def _evict_locked(self):
+        # Evict the least recently used 10% across all scopes
+        ages = sorted(entry.last_used for _, entries in self._scopes.values() for entry in entries)
+        cutoff = ages[max(0, len(ages) // 10 - 1)]
+        for scope in list(self._scopes):
+            self._remove_locked(scope, [entry.last_used > cutoff for entry in self._scopes[scope][1]])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": self._count,
+        }
+
+
+# Process-wide cache shared by all sessions (entries are scoped per user and sources)
+semantic_cache = SemanticCache()
+
+
+if __name__ == "__main__":
+    # Example usage with hand-made query vectors
+    cache = SemanticCache(threshold=0.9)
+    scope = ("newuser", "My Custom Pack", None)
+    cache.store(scope, "who is elon musk?", [1.0, 0.1, 0.0], {"local": [], "pack": ["..."]})
+    print(cache.lookup(scope, [0.98, 0.12, 0.01]).query)
+    print(cache.lookup(scope, [0.0, 1.0, 0.0]))
+    print(cache.stats())
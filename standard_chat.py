@@ -2,23 +2,46 @@ from langchain.chains import LLMChain
 from langchain_community.llms import Replicate
 from langchain_core.prompts import PromptTemplate
 import os
+import threading
 import streamlit as st
 
 # Use the API token from the default section of Streamlit secrets
 os.environ["REPLICATE_API_TOKEN"] = st.secrets["default"]["REPLICATE_API_TOKEN"]
 
-def query_chat(query, model_id):
-    llm = Replicate(
-        model=model_id,
-        model_kwargs={"temperature": 0.75, "max_length": 500, "top_p": 1},
-    )
-    prompt = f"""
+# Process-wide Replicate clients, one per model id
+_llms = {}
+_llms_lock = threading.Lock()
+
+def _build_llm(model_id):
+    """Return the shared Replicate LLM for model_id, creating it on first use."""
+    with _llms_lock:
+        if model_id not in _llms:
+            _llms[model_id] = Replicate(
+                model=model_id,
+                model_kwargs={"temperature": 0.75, "max_length": 500, "top_p": 1},
+            )
+        return _llms[model_id]
+
+def _build_prompt(query):
+    return f"""
     User: {query}
     Assistant:
     """
-    call_llm = llm.invoke(prompt)
+
+def query_chat(query, model_id):
+    llm = _build_llm(model_id)
+    call_llm = llm.invoke(_build_prompt(query))
     return call_llm
 
+def stream_chat(query, model_id):
+    """Yield the response to query as Replicate generates it, token by token."""
+    llm = _build_llm(model_id)
+    for token in llm.stream(_build_prompt(query)):
+        yield token
+
 
 if __name__ == "__main__":
     print(query_chat("Can a dog drive a car?", "meta/meta-llama-3-8b-instruct"))
+    for token in stream_chat("Can a cat drive a car?", "meta/meta-llama-3-8b-instruct"):
+        print(token, end="", flush=True)
+    print()